@@ -0,0 +1,152 @@
+''' End-to-end benchmark of gpvpn_server against gpclientMockUp and gpauthMockUp.
+
+Measures the latency of connect, status and disconnect, the status
+throughput with 1..N concurrent clients, and the resource usage of the
+server. Results are written as JSON, and optionally compared against a
+stored baseline:
+
+    make -C gpclientMockUp && make -C gpauthMockup
+    python -m benchmarks.bench_e2e --output bench_output.json --baseline benchmarks/baseline.json
+'''
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from gpvpn.common import COMMANDS, RETURNCODES
+
+from benchmarks.harness import MockServer, metadata, summarise, write_json
+
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+
+EXPECTED = {COMMANDS.Open: RETURNCODES.Success,
+            COMMANDS.Status: RETURNCODES.Active,
+            COMMANDS.Close: RETURNCODES.Success}
+
+
+async def timed_request(client, command: COMMANDS) -> tuple[float, int]:
+    t0 = time.perf_counter()
+    result = await client.send_request(command)
+    return time.perf_counter() - t0, result["return_code"]
+
+
+async def measure_cycles(server: MockServer, cycles: int) -> tuple[dict, int]:
+    ''' Latency of connect/status/disconnect cycles. Returns latencies and error count. '''
+    latencies = {command: [] for command in EXPECTED}
+    errors = 0
+    client = server.client()
+    try:
+        for _ in range(cycles):
+            for command, expected in EXPECTED.items():
+                latency, return_code = await timed_request(client, command)
+                if return_code == expected:
+                    latencies[command].append(latency)
+                else:
+                    errors += 1
+    finally:
+        client.close()
+    return {command.name.lower(): summarise(values) for command, values in latencies.items()}, errors
+
+
+async def measure_throughput(server: MockServer, n_clients: int, duration: float) -> dict:
+    ''' Status requests per second with n_clients clients polling as fast as they can. '''
+    latencies = []
+    errors = 0
+    clients = [server.client() for _ in range(n_clients)]
+    end_time = time.perf_counter() + duration
+
+    async def poll(client) -> None:
+        nonlocal errors
+        while time.perf_counter() < end_time:
+            latency, return_code = await timed_request(client, COMMANDS.Status)
+            if return_code in (RETURNCODES.Active, RETURNCODES.Inactive):
+                latencies.append(latency)
+            else:
+                errors += 1
+
+    try:
+        t0 = time.perf_counter()
+        await asyncio.gather(*[poll(client) for client in clients])
+        elapsed = time.perf_counter() - t0
+    finally:
+        for client in clients:
+            client.close()
+    return dict(clients=n_clients,
+                rps=len(latencies) / elapsed,
+                errors=errors,
+                latency=summarise(latencies))
+
+
+def run(cycles: int, max_clients: int, duration: float) -> dict:
+    with MockServer() as server:
+        resources_start = server.resources()
+        latency, errors = asyncio.run(measure_cycles(server, cycles))
+        resources_cycles = server.resources()
+        throughput = {}
+        n_clients = 1
+        while n_clients <= max_clients:
+            throughput[str(n_clients)] = asyncio.run(measure_throughput(server, n_clients, duration))
+            n_clients *= 2
+        resources_end = server.resources()
+    return dict(meta=dict(metadata(), cycles=cycles, max_clients=max_clients, duration=duration),
+                latency=latency,
+                errors=errors,
+                throughput=throughput,
+                resources=dict(start=resources_start,
+                               after_cycles=resources_cycles,
+                               end=resources_end))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    ''' Regressions of results with respect to baseline, beyond the relative tolerance. '''
+    regressions = []
+    for command, stats in baseline["latency"].items():
+        for key in ("p50", "p99"):
+            current = results["latency"][command][key]
+            if current > stats[key] * (1 + tolerance):
+                regressions.append(f"{command} {key} latency {current:.1f} ms > baseline {stats[key]:.1f} ms")
+    for n_clients, stats in baseline["throughput"].items():
+        if n_clients not in results["throughput"]:
+            continue
+        current = results["throughput"][n_clients]["rps"]
+        if current < stats["rps"] * (1 - tolerance):
+            regressions.append(f"status throughput with {n_clients} client(s) {current:.0f}/s < baseline {stats['rps']:.0f}/s")
+    for key in ("rss", "fds"):
+        growth = results["resources"]["end"][key] - results["resources"]["start"][key]
+        baseline_growth = baseline["resources"]["end"][key] - baseline["resources"]["start"][key]
+        if growth > max(baseline_growth, 0) * (1 + tolerance) + (1 << 20 if key == "rss" else 2):
+            regressions.append(f"server {key} grew by {growth} > baseline {baseline_growth}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of gpvpn_server against gpclientMockUp.")
+    parser.add_argument('--cycles', type=int, default=20, help="connect/status/disconnect cycles")
+    parser.add_argument('--max-clients', type=int, default=8, help="status throughput is measured for 1, 2, 4, ... clients up to this number")
+    parser.add_argument('--duration', type=float, default=2, help="seconds per throughput measurement")
+    parser.add_argument('--output', help="write results to this file instead of stdout")
+    parser.add_argument('--baseline', help=f"compare against this baseline, for example {DEFAULT_BASELINE}")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed relative regression")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results to the baseline file")
+    args = parser.parse_args()
+
+    results = run(args.cycles, args.max_clients, args.duration)
+    write_json(results, args.output)
+    if args.baseline is None:
+        return 0
+    if args.update_baseline:
+        write_json(results, args.baseline)
+        return 0
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    if results["errors"]:
+        print(f"ERROR: {results['errors']} request(s) returned an unexpected code", file=sys.stderr)
+    return 1 if regressions or results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
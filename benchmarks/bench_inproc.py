@@ -0,0 +1,89 @@
+''' Benchmark of the request/response path of IPCServer, without gpclient.
+
+The server runs in this process with MessageProcessorReverse, which
+does no work of its own. Round trips are measured over inproc://, which
+has neither filesystem nor syscall overhead, and over an ipc:// socket,
+which the gpvpn command uses; the difference is the cost of the
+transport:
+
+    python -m benchmarks.bench_inproc --requests 5000 --clients 1,8
+'''
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+
+import zmq.asyncio
+
+from gpvpn.config import GPVpnAuthConfig
+from gpvpn.message_processors import MessageProcessorReverse
+from gpvpn.server import IPCClient, IPCServer, RateLimiter, unique_url
+
+from benchmarks.harness import metadata, summarise, write_configs, write_json
+
+
+async def client_loop(client: IPCClient, n: int, latencies: list[float]) -> int:
+    ''' Sends n requests, one at a time. Returns the number of unexpected replies. '''
+    errors = 0
+    for _ in range(n):
+        t0 = time.perf_counter()
+        result = await client.send_request("hello")
+        latencies.append(time.perf_counter() - t0)
+        errors += result["return_code"] != "olleh"
+    return errors
+
+
+async def measure(cfg: GPVpnAuthConfig, transport: str, n_clients: int, requests: int) -> dict:
+    context = zmq.asyncio.Context()
+    server = IPCServer(message_processor=MessageProcessorReverse(), url=unique_url(transport), context=context)
+    # all clients are the same user: lift the per-user limits.
+    server.rate_limiter = RateLimiter(rate=1e9, burst=1e9)
+    server.USER_QUEUE_SIZE = server.QUEUE_SIZE
+    server.open()
+    server_task = asyncio.create_task(server.run())
+    await server.ready.wait()
+    clients = [IPCClient(cfg, url=server.url, context=context) for _ in range(n_clients)]
+    latencies = []
+    try:
+        for client in clients:
+            client.open()
+        t0 = time.perf_counter()
+        errors = await asyncio.gather(*(client_loop(client, requests // n_clients, latencies) for client in clients))
+        elapsed = time.perf_counter() - t0
+    finally:
+        for client in clients:
+            client.close()
+        await server.stop()
+        await server_task
+        context.term()
+    return dict(transport=transport,
+                clients=n_clients,
+                errors=sum(errors),
+                rps=len(latencies) / elapsed,
+                latency=summarise(latencies))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark of the request/response path of IPCServer over inproc and ipc.")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per measurement")
+    parser.add_argument('--clients', default="1,8", help="comma separated numbers of concurrent clients")
+    parser.add_argument('--output', help="write results to this file instead of stdout")
+    args = parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="gpvpn-bench-") as directory:
+        _, auth_config_file = write_configs(directory)
+        cfg = GPVpnAuthConfig([auth_config_file])
+    for transport in ("inproc", "ipc"):
+        for n_clients in map(int, args.clients.split(",")):
+            result = asyncio.run(measure(cfg, transport, n_clients, args.requests))
+            results.append(result)
+            print(f"{transport:6} {n_clients:3} clients: {result['rps']:8.0f} requests/s, "
+                  f"p50 {result['latency']['p50']:.3f} ms, p99 {result['latency']['p99']:.3f} ms, "
+                  f"{result['errors']} errors", file=sys.stderr)
+    write_json(dict(meta=dict(metadata(), requests=args.requests), results=results), args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+''' Shared pieces of the benchmark tools.
+
+MockServer runs gpvpn_server in a subprocess, with gpclientMockUp as the
+vpn client and gpauthMockUp for signing in, so that its resource usage can be measured on its own. The
+module is also the entry point of that subprocess:
+
+    python -m benchmarks.harness <socket directory> <configuration file> <wait for lockfile> [<lift rate limit>]
+'''
+import asyncio
+import json
+import math
+import os
+import pathlib
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from gpvpn.config import GPVpnAuthConfig
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+GPCLIENT = REPO / "gpclientMockUp" / "gpclientMockUp"
+GPAUTH = REPO / "gpauthMockup" / "gpauthMockUp"
+
+SERVER_CONFIG = """lock_directory = {directory}
+log_directory = {directory}
+lock_filename = gpclient.lock
+log_filename = gpclient.log
+
+vpnclient_path = {gpclient}
+vpnclient_options = --lockfile={directory}/gpclient.lock {gpclient_options}
+vpnclient_command = connect
+vpnclient_command_options =
+vpnclient_url = gpp.hereon.de
+"""
+
+CLIENT_CONFIG = """vpnauth_path = {gpauth}
+vpnauth_options = {gpauth_options}
+vpnauth_url = gpp.hereon.de
+request_timeout = {request_timeout}
+"""
+
+
+def percentile(values: list[float], q: float) -> float:
+    ''' Nearest-rank percentile (q in 0..100). '''
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarise(latencies: list[float]) -> dict:
+    ''' Latency statistics in milliseconds. '''
+    return dict(n=len(latencies),
+                mean=sum(latencies) / len(latencies) * 1e3 if latencies else float("nan"),
+                p50=percentile(latencies, 50) * 1e3,
+                p90=percentile(latencies, 90) * 1e3,
+                p99=percentile(latencies, 99) * 1e3,
+                max=max(latencies) * 1e3 if latencies else float("nan"))
+
+
+def metadata() -> dict:
+    return dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                cpus=os.cpu_count())
+
+
+def write_json(results: dict, path: str | None) -> None:
+    text = json.dumps(results, indent=2)
+    if path is None:
+        print(text)
+    else:
+        with open(path, 'w') as fp:
+            fp.write(text + "\n")
+
+
+def write_configs(directory: str,
+                  gpclient_options: str = "--timeout=3600",
+                  gpauth_options: str = "",
+                  request_timeout: float = 30) -> tuple[str, str]:
+    ''' Writes the server and client configuration files into directory, and returns their paths.
+
+    The lockfile and the log file of gpclientMockUp are kept in directory too.
+    '''
+    for simulator in (GPCLIENT, GPAUTH):
+        if not simulator.exists():
+            raise FileNotFoundError(f"{simulator} does not exist. Run make -C {simulator.parent.name} first.")
+    config_file = os.path.join(directory, "config.ini")
+    with open(config_file, 'w') as fp:
+        fp.write(SERVER_CONFIG.format(directory=directory,
+                                      gpclient=GPCLIENT,
+                                      gpclient_options=gpclient_options))
+    auth_config_file = os.path.join(directory, "config_auth.ini")
+    with open(auth_config_file, 'w') as fp:
+        fp.write(CLIENT_CONFIG.format(gpauth=GPAUTH,
+                                      gpauth_options=gpauth_options,
+                                      request_timeout=request_timeout))
+    return config_file, auth_config_file
+
+
+class MockServer:
+    ''' gpvpn_server running in a subprocess against gpclientMockUp.
+
+    gpclient_options and gpauth_options configure the timing and faults
+    of the simulators, see gpclientMockUp.c and gpauthMockUp.c.
+    '''
+    def __init__(self,
+                 gpclient_options: str = "--timeout=3600",
+                 gpauth_options: str = "",
+                 wait_for_lockfile: float = 5,
+                 request_timeout: float = 30,
+                 lift_rate_limit: bool = True) -> None:
+        self.gpclient_options = gpclient_options
+        self.gpauth_options = gpauth_options
+        self.wait_for_lockfile = wait_for_lockfile
+        self.request_timeout = request_timeout
+        self.lift_rate_limit = lift_rate_limit
+        self.directory = tempfile.TemporaryDirectory(prefix="gpvpn-bench-")
+        self.path = self.directory.name
+        self.process : subprocess.Popen | None = None
+        self.notify : socket.socket | None = None
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, *p) -> None:
+        self.stop()
+
+    def start(self, timeout: float = 10) -> None:
+        config_file, _ = write_configs(self.path, self.gpclient_options, self.gpauth_options, self.request_timeout)
+        # the server tells us it is ready like it tells systemd.
+        notify_path = os.path.join(self.path, "notify")
+        self.notify = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.notify.bind(notify_path)
+        self.notify.settimeout(timeout)
+        env = dict(os.environ, NOTIFY_SOCKET=notify_path)
+        self.process = subprocess.Popen([sys.executable, "-m", "benchmarks.harness",
+                                         self.path, config_file, str(self.wait_for_lockfile),
+                                         str(int(self.lift_rate_limit))],
+                                        cwd=REPO, env=env)
+        while self.notify.recv(1024) != b"READY=1":
+            pass
+
+    def stop(self, timeout: float = 30) -> int | None:
+        returncode = None
+        if self.process is not None:
+            self.process.send_signal(signal.SIGTERM)
+            returncode = self.process.wait(timeout)
+            self.process = None
+        if self.notify is not None:
+            self.notify.close()
+            self.notify = None
+        self.directory.cleanup()
+        return returncode
+
+    def resources(self) -> dict:
+        ''' Resource usage of the server process. '''
+        process = psutil.Process(self.process.pid)
+        with process.oneshot():
+            return dict(rss=process.memory_info().rss,
+                        fds=process.num_fds(),
+                        threads=process.num_threads(),
+                        children=len(process.children()),
+                        cpu_time=sum(process.cpu_times()[:2]))
+
+    def client(self):
+        ''' An opened IPCClient for this server. The caller closes it. '''
+        from gpvpn.server import IPCClient
+        cfg = GPVpnAuthConfig([os.path.join(self.path, "config_auth.ini")])
+        client = IPCClient(cfg, socket_path=self.path, socket_name="ipcserver")
+        client.open()
+        return client
+
+
+def serve(directory: str, config_file: str, wait_for_lockfile: float, lift_rate_limit: bool = True) -> None:
+    from gpvpn.config import GPVpnConfig
+    from gpvpn.message_processors import MessageProcessorVPNController
+    from gpvpn.server import IPCServer, RateLimiter
+    cfg = GPVpnConfig([config_file])
+    message_processor = MessageProcessorVPNController(cfg, status_page=None)
+    message_processor.WAIT_FOR_LOCKFILE = wait_for_lockfile
+    server = IPCServer(message_processor=message_processor,
+                       socket_path=directory,
+                       socket_name="ipcserver",
+                       handle_signals=True)
+    if lift_rate_limit:
+        # all benchmark clients are the same user: lift the rate limit.
+        server.rate_limiter = RateLimiter(rate=1e6, burst=1e6)
+    server.open()
+    asyncio.run(server.run())
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2], float(sys.argv[3]), len(sys.argv) < 5 or sys.argv[4] == "1")
@@ -0,0 +1,250 @@
+''' Open-loop load generator for gpvpn_server.
+
+Requests arrive as a Poisson process at a fixed mean rate, independent of
+how fast the server replies, and are sent over a pool of concurrent
+IPCClient connections. A request waits for a free connection when all
+are busy; its latency is measured from its scheduled arrival, so that a
+slow server is not hidden by the load generator slowing down with it.
+
+The report (JSON) contains the latency distribution per command, the
+counts of replies per return code, errors and timeouts, and a timeline
+with the throughput, latencies and server CPU usage per interval:
+
+    make -C gpclientMockUp && make -C gpauthMockup
+    python -m benchmarks.loadgen --clients 200 --rate 500 --duration 30 --mix status=0.95,statistics=0.05
+'''
+import argparse
+import asyncio
+import collections
+import random
+import sys
+import time
+
+import psutil
+
+from gpvpn.common import COMMANDS, RETURNCODES
+
+from benchmarks.harness import MockServer, metadata, summarise, write_json
+
+COMMAND_NAMES = dict(status=COMMANDS.Status,
+                     connect=COMMANDS.Open,
+                     disconnect=COMMANDS.Close,
+                     statistics=COMMANDS.Statistics)
+
+ERRORS = (RETURNCODES.Failed, RETURNCODES.CommandNotUnderstood)
+
+
+def parse_mix(mix: str) -> dict[COMMANDS, float]:
+    ''' Parses a command mix such as "status=0.9,statistics=0.1" into normalised weights. '''
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        try:
+            weights[COMMAND_NAMES[name.strip()]] = float(weight) if weight else 1.0
+        except (KeyError, ValueError):
+            raise argparse.ArgumentTypeError(f"Invalid command mix entry {item!r}. "
+                                             f"Use name=weight with name one of {', '.join(COMMAND_NAMES)}.")
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("The weights of the command mix should add up to more than 0.")
+    return {command: weight / total for command, weight in weights.items()}
+
+
+class Interval:
+    ''' Counts and latencies of the requests completed in one interval of the timeline.
+
+    Latencies are those of requests that were served: not rejected as
+    busy, failed or timed out.
+    '''
+    def __init__(self) -> None:
+        self.sent = 0
+        self.latencies = []
+        self.return_codes = collections.Counter()
+        self.errors = 0
+        self.timeouts = 0
+
+    def report(self, t: float, length: float, server: dict) -> dict:
+        latency = summarise(self.latencies)
+        return dict(t=t,
+                    sent=self.sent,
+                    completed=len(self.latencies),
+                    rps=len(self.latencies) / length,
+                    errors=self.errors,
+                    timeouts=self.timeouts,
+                    busy=self.return_codes[RETURNCODES.Busy.name],
+                    p50=latency["p50"],
+                    p99=latency["p99"],
+                    **server)
+
+
+class LoadGenerator:
+    def __init__(self,
+                 server: MockServer,
+                 n_clients: int,
+                 rate: float,
+                 duration: float,
+                 mix: dict[COMMANDS, float],
+                 timeout: float,
+                 interval: float = 1,
+                 seed: int | None = None) -> None:
+        self.server = server
+        self.n_clients = n_clients
+        self.rate = rate
+        self.duration = duration
+        self.mix = mix
+        self.timeout = timeout
+        self.interval = interval
+        self.random = random.Random(seed)
+        self.idle_clients: asyncio.Queue = asyncio.Queue()
+        self.latencies = collections.defaultdict(list)
+        self.return_codes = collections.Counter()
+        self.exceptions = collections.Counter()
+        self.errors = 0
+        self.timeouts = 0
+        self.sent = 0
+        self.max_waiting = 0
+        self.waiting = 0
+        self.timeline: list[dict] = []
+        self.current = Interval()
+
+    def choose_command(self) -> COMMANDS:
+        return self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    async def request(self, command: COMMANDS, scheduled: float) -> None:
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        client = await self.idle_clients.get()
+        self.waiting -= 1
+        interval = self.current
+        try:
+            result = await client.send_request(command, timeout=self.timeout)
+        except Exception as e:
+            self.exceptions[type(e).__name__] += 1
+            self.errors += 1
+            interval.errors += 1
+            self.replace(client)
+            return
+        latency = time.perf_counter() - scheduled
+        return_code = RETURNCODES(result["return_code"])
+        self.return_codes[return_code.name] += 1
+        interval.return_codes[return_code.name] += 1
+        if return_code == RETURNCODES.DeadlineExceeded:
+            self.timeouts += 1
+            interval.timeouts += 1
+            # the reply may still be on its way.
+            self.replace(client)
+            return
+        self.idle_clients.put_nowait(client)
+        if return_code in ERRORS:
+            self.errors += 1
+            interval.errors += 1
+        elif return_code != RETURNCODES.Busy:
+            self.latencies[command].append(latency)
+            interval.latencies.append(latency)
+
+    def replace(self, client) -> None:
+        ''' Replaces a client by a new one: a REQ socket that did not get its reply cannot be used again. '''
+        client.close()
+        self.idle_clients.put_nowait(self.server.client())
+
+    async def arrivals(self) -> None:
+        tasks = set()
+        t0 = time.perf_counter()
+        scheduled = t0
+        while True:
+            scheduled += self.random.expovariate(self.rate)
+            if scheduled - t0 >= self.duration:
+                break
+            await asyncio.sleep(max(0, scheduled - time.perf_counter()))
+            self.sent += 1
+            self.current.sent += 1
+            task = asyncio.create_task(self.request(self.choose_command(), scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    async def sample(self) -> None:
+        ''' Closes an interval of the timeline every self.interval seconds, with the server's resource usage. '''
+        process = psutil.Process(self.server.process.pid)
+        process.cpu_percent()
+        t0 = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            with process.oneshot():
+                server = dict(cpu_percent=process.cpu_percent(),
+                              rss=process.memory_info().rss,
+                              fds=process.num_fds())
+            interval, self.current = self.current, Interval()
+            self.timeline.append(interval.report(round(time.perf_counter() - t0, 3), self.interval, server))
+
+    async def run(self) -> dict:
+        for _ in range(self.n_clients):
+            self.idle_clients.put_nowait(self.server.client())
+        sampler = asyncio.create_task(self.sample())
+        t0 = time.perf_counter()
+        try:
+            await self.arrivals()
+        finally:
+            elapsed = time.perf_counter() - t0
+            sampler.cancel()
+            await asyncio.gather(sampler, return_exceptions=True)
+            while not self.idle_clients.empty():
+                self.idle_clients.get_nowait().close()
+        completed = sum(len(values) for values in self.latencies.values())
+        return dict(sent=self.sent,
+                    completed=completed,
+                    offered_rate=self.rate,
+                    achieved_rate=completed / elapsed,
+                    errors=self.errors,
+                    timeouts=self.timeouts,
+                    exceptions=dict(self.exceptions),
+                    return_codes=dict(self.return_codes),
+                    max_waiting_for_client=self.max_waiting,
+                    latency=summarise([latency for values in self.latencies.values() for latency in values]),
+                    latency_per_command={command.name.lower(): summarise(values)
+                                         for command, values in self.latencies.items()},
+                    timeline=self.timeline)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Open-loop load generator for gpvpn_server.")
+    parser.add_argument('--clients', type=int, default=50, help="number of concurrent client connections")
+    parser.add_argument('--rate', type=float, default=100, help="mean request rate (requests per second)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to generate load")
+    parser.add_argument('--mix', type=parse_mix, default="status=1",
+                        help=f"command mix as name=weight pairs, names: {', '.join(COMMAND_NAMES)}")
+    parser.add_argument('--timeout', type=float, default=5, help="request timeout (seconds)")
+    parser.add_argument('--interval', type=float, default=1, help="length of the intervals of the timeline (seconds)")
+    parser.add_argument('--seed', type=int, help="seed of the arrivals and command mix, for reproducible runs")
+    parser.add_argument('--rate-limit', action='store_true',
+                        help="keep the server's per-user rate limit (all clients are the same user)")
+    parser.add_argument('--gpclient-options', default="--timeout=3600", help="options of gpclientMockUp")
+    parser.add_argument('--output', help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    with MockServer(gpclient_options=args.gpclient_options,
+                    request_timeout=args.timeout,
+                    lift_rate_limit=not args.rate_limit) as server:
+        generator = LoadGenerator(server, args.clients, args.rate, args.duration,
+                                  args.mix, args.timeout, args.interval, args.seed)
+        results = asyncio.run(generator.run())
+    results = dict(meta=dict(metadata(),
+                             clients=args.clients,
+                             rate=args.rate,
+                             duration=args.duration,
+                             mix={command.name.lower(): weight for command, weight in args.mix.items()},
+                             timeout=args.timeout,
+                             seed=args.seed,
+                             rate_limit=args.rate_limit),
+                   **results)
+    write_json(results, args.output)
+    latency = results["latency"]
+    print(f"{results['completed']}/{results['sent']} requests served at {results['achieved_rate']:.0f}/s "
+          f"(offered {args.rate:.0f}/s): p50 {latency['p50']:.1f} ms, p99 {latency['p99']:.1f} ms, "
+          f"{results['errors']} errors, {results['timeouts']} timeouts, "
+          f"{results['return_codes'].get('Busy', 0)} busy.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+''' Soak test: repeated connect/status/disconnect cycles, watching for resource leaks.
+
+The server, the vpn controller and the clients run in this process
+against gpclientMockUp and gpauthMockUp, so that leaks on either side
+show up in the open file descriptors, child processes (and zombies),
+RSS and the allocations traced by tracemalloc. These are sampled over
+time, after a number of warm-up cycles. The run fails when their growth
+exceeds the thresholds:
+
+    make -C gpclientMockUp && make -C gpauthMockup
+    python -m benchmarks.soak --cycles 2000 --output soak.json
+'''
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import psutil
+
+from gpvpn.common import COMMANDS, RETURNCODES
+from gpvpn.config import GPVpnAuthConfig, GPVpnConfig
+from gpvpn.message_processors import MessageProcessorVPNController
+from gpvpn.server import IPCClient, IPCServer, RateLimiter
+
+from benchmarks.harness import metadata, write_json, write_configs
+
+EXPECTED = {COMMANDS.Open: RETURNCODES.Success,
+            COMMANDS.Status: RETURNCODES.Active,
+            COMMANDS.Close: RETURNCODES.Success}
+
+
+def sample(cycle: int, t0: float) -> dict:
+    process = psutil.Process()
+    with process.oneshot():
+        children = process.children(recursive=True)
+        zombies = 0
+        for child in children:
+            try:
+                zombies += child.status() == psutil.STATUS_ZOMBIE
+            except psutil.NoSuchProcess:
+                pass
+        return dict(cycle=cycle,
+                    t=round(time.perf_counter() - t0, 3),
+                    fds=process.num_fds(),
+                    children=len(children),
+                    zombies=zombies,
+                    rss=process.memory_info().rss,
+                    traced=tracemalloc.get_traced_memory()[0])
+
+
+def top_allocators(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, n: int) -> list[dict]:
+    ''' The n source lines whose allocations grew most between the snapshots. '''
+    statistics = after.compare_to(before, "lineno")
+    return [dict(location=str(s.traceback[0]), size_diff=s.size_diff, count_diff=s.count_diff)
+            for s in statistics[:n]]
+
+
+class Soak:
+    def __init__(self, directory: str, cycles: int, warmup: int, sample_every: int, reuse_client: bool) -> None:
+        self.directory = directory
+        self.cycles = cycles
+        self.warmup = warmup
+        self.sample_every = sample_every
+        self.reuse_client = reuse_client
+        self.config_file, self.auth_config_file = write_configs(directory)
+        self.samples: list[dict] = []
+        self.errors: dict[str, int] = {}
+
+    def client(self) -> IPCClient:
+        client = IPCClient(GPVpnAuthConfig([self.auth_config_file]),
+                           socket_path=self.directory, socket_name="ipcserver")
+        client.open()
+        return client
+
+    async def cycle(self, client: IPCClient) -> None:
+        for command, expected in EXPECTED.items():
+            result = await client.send_request(command)
+            return_code = RETURNCODES(result["return_code"])
+            if return_code != expected:
+                key = f"{command.name}: {return_code.name}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    async def run(self) -> tracemalloc.Snapshot:
+        message_processor = MessageProcessorVPNController(GPVpnConfig([self.config_file]), status_page=None)
+        server = IPCServer(message_processor=message_processor,
+                           socket_path=self.directory,
+                           socket_name="ipcserver")
+        server.rate_limiter = RateLimiter(rate=1e6, burst=1e6)
+        server.open()
+        server_task = asyncio.create_task(server.run())
+        client = self.client() if self.reuse_client else None
+        t0 = time.perf_counter()
+        snapshot = None
+        try:
+            for i in range(self.warmup + self.cycles + 1):
+                if i == self.warmup:
+                    snapshot = tracemalloc.take_snapshot()
+                    t0 = time.perf_counter()
+                cycle = i - self.warmup
+                if cycle >= 0 and (cycle % self.sample_every == 0 or cycle == self.cycles):
+                    self.samples.append(sample(cycle, t0))
+                if cycle == self.cycles:
+                    break
+                if not self.reuse_client:
+                    client = self.client()
+                try:
+                    await self.cycle(client)
+                finally:
+                    if not self.reuse_client:
+                        client.close()
+        finally:
+            if self.reuse_client:
+                client.close()
+            await server.stop()
+            await server_task
+        return snapshot
+
+
+def check(samples: list[dict], args: argparse.Namespace) -> list[str]:
+    ''' Growth over the soak (after the warm-up) beyond the thresholds. '''
+    first, last = samples[0], samples[-1]
+    failures = []
+    if last["fds"] - first["fds"] > args.max_fd_growth:
+        failures.append(f"open file descriptors grew from {first['fds']} to {last['fds']}")
+    if max(s["children"] for s in samples) > args.max_children:
+        failures.append(f"up to {max(s['children'] for s in samples)} child processes after a disconnect")
+    if max(s["zombies"] for s in samples) > args.max_zombies:
+        failures.append(f"up to {max(s['zombies'] for s in samples)} zombie processes")
+    if last["rss"] - first["rss"] > args.max_rss_growth * 2**20:
+        failures.append(f"RSS grew by {(last['rss'] - first['rss']) / 2**20:.1f} MiB")
+    if last["traced"] - first["traced"] > args.max_traced_growth * 2**20:
+        failures.append(f"traced memory grew by {(last['traced'] - first['traced']) / 2**20:.1f} MiB")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Soak test of gpvpn_server, watching for resource leaks.")
+    parser.add_argument('--cycles', type=int, default=1000, help="connect/status/disconnect cycles")
+    parser.add_argument('--warmup', type=int, default=20, help="cycles before the measurements start")
+    parser.add_argument('--sample-every', type=int, default=50, help="sample resources every this many cycles")
+    parser.add_argument('--reuse-client', action='store_true',
+                        help="use one client for all cycles, rather than a new client per cycle like the gpvpn command")
+    parser.add_argument('--max-fd-growth', type=int, default=2, help="allowed growth of open file descriptors")
+    parser.add_argument('--max-children', type=int, default=0, help="allowed child processes after a disconnect")
+    parser.add_argument('--max-zombies', type=int, default=0, help="allowed zombie processes")
+    parser.add_argument('--max-rss-growth', type=float, default=20, help="allowed RSS growth (MiB)")
+    parser.add_argument('--max-traced-growth', type=float, default=2, help="allowed growth of memory traced by tracemalloc (MiB)")
+    parser.add_argument('--top', type=int, default=10, help="report this many top allocators")
+    parser.add_argument('--output', help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory(prefix="gpvpn-soak-") as directory:
+        soak = Soak(directory, args.cycles, args.warmup, args.sample_every, args.reuse_client)
+        snapshot = asyncio.run(soak.run())
+    allocators = top_allocators(snapshot, tracemalloc.take_snapshot(), args.top)
+    failures = check(soak.samples, args)
+    if soak.errors:
+        failures.append(f"unexpected replies: {soak.errors}")
+    results = dict(meta=dict(metadata(), **vars(args)),
+                   samples=soak.samples,
+                   top_allocators=allocators,
+                   errors=soak.errors,
+                   failures=failures)
+    write_json(results, args.output)
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
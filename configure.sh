@@ -6,6 +6,7 @@ GPAUTH=/usr/bin/gpauth
 CONFIG_AUTH_DIR=$HOME/.config/gpvpn
 CONFIG_DIR=/usr/local/etc/gpvpn
 SYSTEMD_SERVICE_NAME=gpvpn.service
+SYSTEMD_SOCKET_NAME=gpvpn.socket
 SYSTEMD_SERVICE_FILE_SOURCE_DIR=systemd
 SYSTEMD_SERVICE_DIR=/etc/systemd/system
 
@@ -114,8 +115,9 @@ read -r -p "Shall I install a systemd service to start gpvpn_server automaticall
 
 if [[ $answer =~ ^[yY]$ ]]; then
     sudo cp ${SYSTEMD_SERVICE_FILE_SOURCE_DIR}/${SYSTEMD_SERVICE_NAME} ${SYSTEMD_SERVICE_DIR}
+    sudo cp ${SYSTEMD_SERVICE_FILE_SOURCE_DIR}/${SYSTEMD_SOCKET_NAME} ${SYSTEMD_SERVICE_DIR}
     sudo systemctl daemon-reload                                                                                                             
-    sudo systemctl enable --now "${SYSTEMD_SERVICE_NAME%.service}"
+    sudo systemctl enable --now "${SYSTEMD_SOCKET_NAME}"
 else
     echo "⚠️ Skipping systemd installation."
 fi
@@ -0,0 +1,96 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include <unistd.h>
+#include <getopt.h>
+
+// Simulator of gpauth. Prints the cookie that gpauth obtains from the
+// portal after signing in on the website, as JSON on stdout. Options of
+// the real gpauth (--fix-openssl, --default-browser, --gateway) and the
+// gateway url are accepted and ignored. Further options:
+//
+//   --delay=SECONDS    time the user takes to sign in
+//   --jitter=SECONDS   add a uniformly distributed random time of up to this many seconds
+//   --seed=N           seed of the jitter, for reproducible runs
+//   --fail             the sign in fails: exit with code 1 without printing a cookie
+//   --cookie=STRING    print this cookie instead of the default one
+//   --chatty           write progress messages to stderr, like a browser does
+
+#define COOKIE "{\"success\":{\"portalUserauthcookie\":\"\",\"preloginCookie\":\"HyiL+E5lbwtah/vkSYDaJ0AZfAk+GLJIEjmjrXvnfNn3v1eDS+cgDY7NbjvwZjb28WQQeQ==\",\"token\":null,\"username\":\"lucas.merckelbach@hereon.de\"}}"
+
+enum {
+  OPT_DELAY = 256,
+  OPT_JITTER,
+  OPT_SEED,
+  OPT_FAIL,
+  OPT_COOKIE,
+  OPT_CHATTY
+};
+
+// Define the expected options
+static struct option long_options[] = {
+  {"delay", required_argument, 0, OPT_DELAY},
+  {"jitter", required_argument, 0, OPT_JITTER},
+  {"seed", required_argument, 0, OPT_SEED},
+  {"fail", no_argument, 0, OPT_FAIL},
+  {"cookie", required_argument, 0, OPT_COOKIE},
+  {"chatty", no_argument, 0, OPT_CHATTY},
+  {0, 0, 0, 0}
+};
+
+void sleep_seconds(double seconds) {
+  if (seconds <= 0)
+    return;
+  struct timespec ts;
+  ts.tv_sec = (time_t) seconds;
+  ts.tv_nsec = (long) ((seconds - ts.tv_sec) * 1e9);
+  nanosleep(&ts, NULL);
+}
+
+int main(int argc, char *argv[]) {
+  int opt;
+  double delay = 0;
+  double jitter = 0;
+  unsigned int seed = (unsigned int) time(NULL) ^ (unsigned int) getpid();
+  int fail = 0;
+  const char *cookie = COOKIE;
+  int chatty = 0;
+
+  opterr = 0; // options of the real gpauth are ignored.
+  while ((opt = getopt_long(argc, argv, "", long_options, NULL)) != -1) {
+    switch (opt) {
+    case OPT_DELAY:
+      delay = atof(optarg);
+      break;
+    case OPT_JITTER:
+      jitter = atof(optarg);
+      break;
+    case OPT_SEED:
+      seed = (unsigned int) strtoul(optarg, NULL, 10);
+      break;
+    case OPT_FAIL:
+      fail = 1;
+      break;
+    case OPT_COOKIE:
+      cookie = optarg;
+      break;
+    case OPT_CHATTY:
+      chatty = 1;
+      break;
+    }
+  }
+  srandom(seed);
+  delay += jitter * random() / RAND_MAX;
+
+  if (chatty)
+    fprintf(stderr, "Opening the sign in page in the default browser...\n");
+  sleep_seconds(delay);
+  if (fail) {
+    fprintf(stderr, "Sign in failed.\n");
+    return EXIT_FAILURE;
+  }
+  if (chatty)
+    fprintf(stderr, "Signed in after %.3f seconds.\n", delay);
+  printf("%s\n", cookie);
+  return EXIT_SUCCESS;
+}
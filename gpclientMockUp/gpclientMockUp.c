@@ -1,5 +1,8 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
 #include <unistd.h>
 #include <signal.h>
 #include <sys/types.h>
@@ -9,19 +12,125 @@
 
 #define LOCK_FILE "/tmp/gpclient.lock"
 
+// Simulator of gpclient. Without options it behaves as before: it reads
+// the cookie, writes the lock file, works for --timeout seconds and
+// removes the lock file again. The other options reproduce real-world
+// timing and failures:
+//
+//   --lockfile=PATH            lock file to write (default /tmp/gpclient.lock)
+//   --startup-delay=SECONDS    time to bring the tunnel up (mean of the distribution)
+//   --delay-distribution=NAME  fixed (default), uniform or normal
+//   --delay-spread=SECONDS     half width (uniform) or standard deviation (normal)
+//   --seed=N                   seed of the random delay, for reproducible runs
+//   --lockfile-early           write the lock file before the tunnel is up, rather than after
+//   --crash-after=SECONDS      exit with code 3 after this many seconds, leaving a stale lock file
+//   --ignore-sigterm           ignore SIGTERM, so that only SIGKILL stops the process
+//   --reject-cookie            reject the cookie: exit with code 2 without writing a lock file
+//   --chatty=N                 write N lines of log output per second while running
 
-// Define the expected option
+enum {
+  OPT_LOCKFILE = 256,
+  OPT_STARTUP_DELAY,
+  OPT_DELAY_DISTRIBUTION,
+  OPT_DELAY_SPREAD,
+  OPT_SEED,
+  OPT_LOCKFILE_EARLY,
+  OPT_CRASH_AFTER,
+  OPT_IGNORE_SIGTERM,
+  OPT_REJECT_COOKIE,
+  OPT_CHATTY
+};
+
+// Define the expected options
 static struct option long_options[] = {
   {"cookie-on-stdin", no_argument, 0, 'c'},
   {"timeout", required_argument, 0, 't'},
+  {"lockfile", required_argument, 0, OPT_LOCKFILE},
+  {"startup-delay", required_argument, 0, OPT_STARTUP_DELAY},
+  {"delay-distribution", required_argument, 0, OPT_DELAY_DISTRIBUTION},
+  {"delay-spread", required_argument, 0, OPT_DELAY_SPREAD},
+  {"seed", required_argument, 0, OPT_SEED},
+  {"lockfile-early", no_argument, 0, OPT_LOCKFILE_EARLY},
+  {"crash-after", required_argument, 0, OPT_CRASH_AFTER},
+  {"ignore-sigterm", no_argument, 0, OPT_IGNORE_SIGTERM},
+  {"reject-cookie", no_argument, 0, OPT_REJECT_COOKIE},
+  {"chatty", required_argument, 0, OPT_CHATTY},
   {0, 0, 0, 0}
 };
 
+static const char *lock_file = LOCK_FILE;
+static double start_time;
+
+double now(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+void sleep_seconds(double seconds) {
+  if (seconds <= 0)
+    return;
+  struct timespec ts;
+  ts.tv_sec = (time_t) seconds;
+  ts.tv_nsec = (long) ((seconds - ts.tv_sec) * 1e9);
+  nanosleep(&ts, NULL);
+}
+
+double uniform(void) {
+  return (random() + 1.0) / (RAND_MAX + 2.0);
+}
+
+double startup_delay(double mean, const char *distribution, double spread) {
+  double delay = mean;
+  if (strcmp(distribution, "uniform") == 0) {
+    delay = mean + spread * (2 * uniform() - 1);
+  } else if (strcmp(distribution, "normal") == 0) {
+    // Box-Muller transform
+    delay = mean + spread * sqrt(-2 * log(uniform())) * cos(2 * M_PI * uniform());
+  }
+  return delay > 0 ? delay : 0;
+}
+
+int write_lock_file(void) {
+  int fd = open(lock_file, O_CREAT | O_EXCL | O_WRONLY, 0644);
+  if (fd < 0) {
+    perror("Could not create lock file");
+    return -1;
+  }
+  // Write the PID to the lock file
+  dprintf(fd, "%d\n", getpid());
+  close(fd);
+  fprintf(stderr, "Lock file created: %s with PID: %d\n", lock_file, getpid());
+  return 0;
+}
+
+// Sleeps until the given time since start, writing log lines if chatty.
+// Returns 1 if the crash time is reached first.
+int run_until(double until, double crash_after, int chatty) {
+  double interval = chatty > 0 ? 1.0 / chatty : 0;
+  while (1) {
+    double elapsed = now() - start_time;
+    if (crash_after >= 0 && elapsed >= crash_after)
+      return 1;
+    if (elapsed >= until)
+      return 0;
+    double next = until;
+    if (crash_after >= 0 && crash_after < next)
+      next = crash_after;
+    if (interval > 0) {
+      if (elapsed + interval < next)
+        next = elapsed + interval;
+      printf("[%.3f] tunnel traffic: keepalive sent\n", elapsed);
+      fflush(stdout);
+    }
+    sleep_seconds(next - elapsed);
+  }
+}
 
 void signal_handler(int sig) {
     if (sig == SIGTERM) {
         // Remove the lock file before exiting
-        unlink(LOCK_FILE);
+        unlink(lock_file);
         printf("Lock file removed. Exiting...\n");
         exit(0);
     }
@@ -32,6 +141,18 @@ int main(int argc, char *argv[]) {
   int opt;
   int cookie_on_stdin_present = 0;
   int timeout = 30;
+  double delay_mean = 0;
+  const char *distribution = "fixed";
+  double delay_spread = 0;
+  unsigned int seed = (unsigned int) time(NULL) ^ (unsigned int) getpid();
+  int lockfile_early = 0;
+  double crash_after = -1;
+  int ignore_sigterm = 0;
+  int reject_cookie = 0;
+  int chatty = 0;
+
+  start_time = now();
+  opterr = 0; // options of the real gpclient, such as --fix-openssl, are ignored.
   while ((opt = getopt_long(argc, argv, "c", long_options, NULL)) != -1) {
     switch (opt) {
     case 'c':
@@ -40,9 +161,44 @@ int main(int argc, char *argv[]) {
     case 't':
       timeout = atoi(optarg);
       break;
+    case OPT_LOCKFILE:
+      lock_file = optarg;
+      break;
+    case OPT_STARTUP_DELAY:
+      delay_mean = atof(optarg);
+      break;
+    case OPT_DELAY_DISTRIBUTION:
+      if (strcmp(optarg, "fixed") && strcmp(optarg, "uniform") && strcmp(optarg, "normal")) {
+        fprintf(stderr, "Unknown delay distribution %s.\n", optarg);
+        return EXIT_FAILURE;
+      }
+      distribution = optarg;
+      break;
+    case OPT_DELAY_SPREAD:
+      delay_spread = atof(optarg);
+      break;
+    case OPT_SEED:
+      seed = (unsigned int) strtoul(optarg, NULL, 10);
+      break;
+    case OPT_LOCKFILE_EARLY:
+      lockfile_early = 1;
+      break;
+    case OPT_CRASH_AFTER:
+      crash_after = atof(optarg);
+      break;
+    case OPT_IGNORE_SIGTERM:
+      ignore_sigterm = 1;
+      break;
+    case OPT_REJECT_COOKIE:
+      reject_cookie = 1;
+      break;
+    case OPT_CHATTY:
+      chatty = atoi(optarg);
+      break;
     }
   }
-  
+  srandom(seed);
+
   if (cookie_on_stdin_present){
     // read all there is from stdin
     char buffer[256];
@@ -50,30 +206,35 @@ int main(int argc, char *argv[]) {
       fprintf(stderr, "Received: %s", buffer);
     }
   }
-  
-  // Create a lock file
-  int fd = open(LOCK_FILE, O_CREAT | O_EXCL | O_WRONLY, 0644);
-  if (fd < 0) {
-    perror("Could not create lock file");
-    return EXIT_FAILURE;
+  if (reject_cookie) {
+    fprintf(stderr, "Gateway rejected the cookie: authentication failed.\n");
+    return 2;
   }
 
-  // Write the PID to the lock file
-  pid_t pid = getpid();
-  dprintf(fd, "%d\n", pid);
-  close(fd);
   // Register sigterm handler
-  signal(SIGTERM, signal_handler);
-  
-  fprintf(stderr, "Lock file created: %s with PID: %d\n", LOCK_FILE, getpid());
-  
+  signal(SIGTERM, ignore_sigterm ? SIG_IGN : signal_handler);
+
+  if (lockfile_early && write_lock_file() < 0)
+    return EXIT_FAILURE;
+  double ready = startup_delay(delay_mean, distribution, delay_spread);
+  fprintf(stderr, "Connecting to gateway, this takes %.3f seconds...\n", ready);
+  if (run_until(ready, crash_after, chatty)) {
+    fprintf(stderr, "Crashed while connecting.\n");
+    return 3;
+  }
+  if (!lockfile_early && write_lock_file() < 0)
+    return EXIT_FAILURE;
+  fprintf(stderr, "Connected to gateway.\n");
+
   // Loop for some seconds. This should be enough for tests, and we don't get
   // lingering applications.
   fprintf(stderr, "Simulating %d seconds of work...", timeout);
-  sleep(timeout);
-  
-  unlink(LOCK_FILE);
+  if (run_until(ready + timeout, crash_after, chatty)) {
+    fprintf(stderr, "Crashed, leaving lock file %s behind.\n", lock_file);
+    return 3;
+  }
+
+  unlink(lock_file);
   fprintf(stderr, "Removing lockfile and exiting.");
   return EXIT_SUCCESS;
 }
-
@@ -1,11 +1,16 @@
+import dataclasses
 import enum
 import json
+import pwd
 
 class COMMANDS(enum.IntEnum):
     Status = enum.auto()
     Open = enum.auto()
     Close  = enum.auto()
     Quit = enum.auto()
+    Statistics = enum.auto()
+    Profile = enum.auto()
+    Hooks = enum.auto()
 
 class RETURNCODES(enum.IntEnum):
     Active = enum.auto()
@@ -17,16 +22,40 @@ class RETURNCODES(enum.IntEnum):
     Failed = enum.auto()
     QuitApplication = enum.auto()
     CommandNotUnderstood = enum.auto()
+    Busy = enum.auto()
+    DeadlineExceeded = enum.auto()
+    NotPermitted = enum.auto()
+    NotOwner = enum.auto()
     
 class ERRORCODES(enum.IntEnum):
     GroupError = enum.auto()
 
 GROUPNAME = "gpvpn"
+STATUS_PAGE = "/var/run/gpvpn.status"
+
+@dataclasses.dataclass(frozen=True)
+class Peer:
+    ''' Credentials of the process at the other end of a connection. '''
+    uid: int = -1
+    pid: int = -1
+    key: str = "" # CURVE public key (z85) of a client connected over TCP
+
+def user_name(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
 
 def serialise(function: typing.Callable) -> typing.Any:
     async def wrapper(*p) -> str:
-        return_code = await function(*p)
-        d = dict(return_code=return_code)
+        result = await function(*p)
+        # functions return either a return code, or a return code and
+        # a dictionary with additional information.
+        if isinstance(result, tuple):
+            return_code, extra = result
+        else:
+            return_code, extra = result, {}
+        d = dict(return_code=return_code, **extra)
         return json.dumps(d)
     return wrapper
 
@@ -3,6 +3,9 @@ from pathlib import Path
 from typing import Any, Dict, Iterable, Optional, Type, TypeVar
 import configparser
 import logging
+import os
+import shlex
+import shutil
 
 T = TypeVar("T", bound="BaseConfig")
 logger = logging.getLogger(__name__)
@@ -92,6 +95,24 @@ def _coerce_type(raw: str, typ: Any, default: Any) -> Any:
     # fallback to string
     return raw
 
+def split_options(name: str, value: str) -> list:
+    """Splits command line options like a shell does, honouring quotes."""
+    try:
+        return shlex.split(value)
+    except ValueError as e:
+        raise ConfigError(f"Invalid configuration: cannot split {name} ({e}).")
+
+def check_executable(name: str, path: str) -> Optional[str]:
+    """A description of what is wrong with executable path, if anything."""
+    if not path:
+        return f"{name} is empty"
+    resolved = path if os.sep in path else shutil.which(path)
+    if resolved is None or not os.path.isfile(resolved):
+        return f"{name} {path} does not exist"
+    if not os.access(resolved, os.X_OK):
+        return f"{name} {path} is not executable"
+    return None
+
 def _to_str(val: Any) -> str:
     if isinstance(val, (list, tuple)):
         return ",".join(map(str, val))
@@ -121,6 +142,123 @@ class GPVpnConfig(BaseConfig):
     vpnclient_command_options: str = "--browser default"
     vpnclient_url: str = "vpn.hereon.de"
 
+    # optional TCP socket for gpvpn fleet, e.g. tcp://0.0.0.0:5555; empty: ipc socket only
+    tcp_url: str = ""
+    # server.key_secret, and the public keys of the fleet clients in authorized_keys/
+    curve_directory: str = "/usr/local/etc/gpvpn/curve"
+
+    # tunnel quality monitor: host:port inside the vpn to probe; empty: no monitoring
+    monitor_target: str = ""
+    monitor_protocol: str = "tcp" # tcp (connect) or udp (echo service)
+    monitor_interval: float = 10.0 # seconds between probes
+    monitor_timeout: float = 2.0 # seconds before a probe counts as lost
+    monitor_window: int = 30 # probes the statistics are computed over
+    monitor_max_loss: float = 0.2 # fraction of lost probes, above which the link is degraded
+    monitor_max_rtt: float = 500.0 # mean round trip time (ms), above which the link is degraded
+    monitor_reconnect: bool = False # restart gpclient when the link is degraded
+
+    # executables in post-connect.d and pre-disconnect.d under this directory are run on connect and disconnect
+    hooks_directory: str = "/usr/local/etc/gpvpn"
+    hook_concurrency: int = 4 # hooks run at the same time
+    hook_timeout: float = 30.0 # seconds before a hook is killed
+
+    def snapshot(self) -> "GPVpnSettings":
+        """The settings of the vpn controller derived from this configuration.
+
+        The command line of gpclient is split into its arguments here,
+        once, rather than for every connect.
+        """
+        vpn_command = (self.vpnclient_path,
+                       *split_options("vpnclient_options", self.vpnclient_options),
+                       *split_options("vpnclient_command", self.vpnclient_command),
+                       *split_options("vpnclient_command_options", self.vpnclient_command_options),
+                       self.vpnclient_url)
+        return GPVpnSettings(lockfile=str(Path(self.lock_directory) / self.lock_filename),
+                             logfile=str(Path(self.log_directory) / self.log_filename),
+                             vpn_command=vpn_command,
+                             gateway=self.vpnclient_url)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class GPVpnSettings:
+    """Immutable snapshot of the settings the vpn controller works with.
+
+    A reload replaces the snapshot as a whole, so a connect never sees
+    a mix of old and new settings.
+    """
+    lockfile: str
+    logfile: str
+    vpn_command: tuple
+    gateway: str
+
+    def validate(self) -> "GPVpnSettings":
+        """Raises ConfigError listing what is wrong with the settings."""
+        problems = []
+        for name in ("lockfile", "logfile"):
+            directory = os.path.dirname(getattr(self, name)) or "."
+            if not os.path.isdir(directory):
+                problems.append(f"directory {directory} of the {name} does not exist")
+        problem = check_executable("vpnclient_path", self.vpn_command[0])
+        if problem:
+            problems.append(problem)
+        if not self.gateway:
+            problems.append("vpnclient_url is empty")
+        if problems:
+            raise ConfigError("Invalid configuration: " + "; ".join(problems) + ".")
+        return self
+
+
+class ConfigWatcher:
+    """Rereads the configuration files when they have changed.
+
+    Changes are detected by modification time and size, so checking
+    unchanged files costs a few stat calls only.
+    """
+    def __init__(self, paths: Optional[Iterable[Path]] = None, config_class: type = GPVpnConfig) -> None:
+        if paths is None:
+            paths = config_class.__dataclass_fields__["config_paths"].default_factory()
+        self.paths = [Path(p) for p in paths]
+        self.config_class = config_class
+        self.stamp: tuple | None = None
+
+    def current_stamp(self) -> tuple:
+        stamp = []
+        for p in self.paths:
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def changed(self) -> bool:
+        return self.current_stamp() != self.stamp
+
+    def load(self) -> GPVpnConfig:
+        """Reads the configuration files, and remembers their state."""
+        self.stamp = self.current_stamp()
+        return self.config_class(config_paths=list(self.paths))
+
+    def poll(self) -> Optional[GPVpnSettings]:
+        """New validated settings if the files have changed, else None.
+
+        Invalid configurations are logged and ignored, until the files
+        change again.
+        """
+        if not self.changed():
+            return None
+        logger.info("Configuration files changed. Reloading...")
+        try:
+            return self.load().snapshot().validate()
+        except (configparser.Error, ConfigError, OSError) as e:
+            logger.error(f"Keeping the current configuration. {e}")
+            return None
+
 @dataclass
 class GPVpnAuthConfig(BaseConfig):
     # locations checked in order; subclasses can override or extend
@@ -132,3 +270,25 @@ class GPVpnAuthConfig(BaseConfig):
     vpnauth_path: str = "/usr/bin/gpauth"
     vpnauth_options: str = "--fix-openssl --default-browser --gateway"
     vpnauth_url: str = "gpp.hereon.de"
+
+    request_timeout: float = 30.0 # seconds the server may take to handle a request
+
+    # gpvpn fleet: client.key_secret, and the public keys of the servers in servers/<host>.key
+    fleet_curve_directory: str = "~/.config/gpvpn/curve"
+    fleet_port: int = 5555
+    fleet_concurrency: int = 16 # servers queried at the same time
+    fleet_timeout: float = 5.0 # seconds to wait for the reply of a server
+
+    def auth_command(self) -> tuple:
+        """The command line of gpauth, split into its arguments."""
+        return (self.vpnauth_path,
+                *split_options("vpnauth_options", self.vpnauth_options),
+                self.vpnauth_url)
+
+    def validate(self) -> "GPVpnAuthConfig":
+        """Raises ConfigError when gpauth cannot be run."""
+        self.auth_command()
+        problem = check_executable("vpnauth_path", self.vpnauth_path)
+        if problem:
+            raise ConfigError(f"Invalid configuration: {problem}.")
+        return self
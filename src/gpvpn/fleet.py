@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import time
+
+import zmq
+
+from gpvpn import config
+from gpvpn.server import IPCClient, load_curve_keys
+from gpvpn.common import COMMANDS, RETURNCODES
+
+logger = logging.getLogger(__name__)
+
+# Fleet control: the same command sent to the gpvpn servers of many
+# hosts at once, over their CURVE authenticated TCP sockets, with the
+# replies gathered in one table or JSON document.
+
+FLEET_COMMANDS = dict(status=COMMANDS.Status,
+                      disconnect=COMMANDS.Close,
+                      stop_server=COMMANDS.Quit,
+                      statistics=COMMANDS.Statistics)
+
+# replies that mean the server did what it was asked.
+EXPECTED = {COMMANDS.Status: (RETURNCODES.Active, RETURNCODES.Inactive),
+            COMMANDS.Close: (RETURNCODES.Success, RETURNCODES.AlreadyDisconnected),
+            COMMANDS.Quit: (RETURNCODES.QuitApplication,),
+            COMMANDS.Statistics: (RETURNCODES.Success,)}
+
+
+def endpoint(host: str, port: int) -> str:
+    ''' The url of the server of host, given as name, name:port or url. '''
+    if "://" in host:
+        return host
+    if ":" in host:
+        return f"tcp://{host}"
+    return f"tcp://{host}:{port}"
+
+
+def host_name(host: str) -> str:
+    return host.split("://")[-1].rsplit(":", 1)[0]
+
+
+class Fleet:
+    def __init__(self,
+                 cfg: config.GPVpnAuthConfig,
+                 hosts: list[str],
+                 concurrency: int | None = None,
+                 timeout: float | None = None) -> None:
+        self.cfg = cfg
+        self.hosts = hosts
+        self.concurrency = cfg.fleet_concurrency if concurrency is None else concurrency
+        self.timeout = cfg.fleet_timeout if timeout is None else timeout
+        self.directory = os.path.expanduser(cfg.fleet_curve_directory)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def server_key(self, host: str) -> bytes:
+        ''' Public key of the server of host: servers/<host>.key, or servers/server.key shared by all. '''
+        servers = os.path.join(self.directory, "servers")
+        for name in (host_name(host), "server"):
+            path = os.path.join(servers, f"{name}.key")
+            if os.path.exists(path):
+                return load_curve_keys(path)[0]
+        raise FileNotFoundError(f"No public key of {host} in {servers}")
+
+    def client(self, host: str) -> IPCClient:
+        public, secret = load_curve_keys(os.path.join(self.directory, "client.key_secret"))
+        return IPCClient(self.cfg,
+                         url=endpoint(host, self.cfg.fleet_port),
+                         curve_keys=(public, secret, self.server_key(host)))
+
+    async def send(self, host: str, command: COMMANDS) -> dict:
+        ''' The reply of the server of host, with the time it took (elapsed, seconds). '''
+        async with self.semaphore:
+            t0 = time.monotonic()
+            client = None
+            try:
+                client = self.client(host)
+                client.open()
+                result = await client.send_request(command, timeout=self.timeout)
+            except (OSError, ValueError, zmq.ZMQError) as e:
+                logger.error(f"{host}: {e}")
+                result = dict(return_code=RETURNCODES.Failed, error=str(e))
+            finally:
+                if client is not None:
+                    client.close()
+            return_code = RETURNCODES(result.pop("return_code"))
+            return dict(host=host,
+                        return_code=return_code.name,
+                        ok=return_code in EXPECTED[command],
+                        elapsed=round(time.monotonic() - t0, 3),
+                        **result)
+
+    async def run(self, command: COMMANDS) -> list[dict]:
+        ''' Sends command to all hosts, at most concurrency at a time. Replies are in the order of the hosts. '''
+        return await asyncio.gather(*(self.send(host, command) for host in self.hosts))
+
+
+def summary(results: list[dict]) -> dict:
+    return dict(hosts=len(results),
+                ok=sum(result["ok"] for result in results),
+                return_codes=dict(collections.Counter(result["return_code"] for result in results)))
+
+
+def format_table(results: list[dict]) -> str:
+    ''' One line per host, with the gateway, state change time and owner if reported. '''
+    rows = [("HOST", "RESULT", "GATEWAY", "SINCE", "OWNER", "MS")]
+    for result in results:
+        since = result.get("since")
+        rows.append((result["host"],
+                     result["return_code"],
+                     result.get("gateway") or "",
+                     time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(since)) if since else "",
+                     result.get("owner") or "",
+                     f"{result['elapsed'] * 1000:.0f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+    counts = summary(results)
+    lines.append(f"{counts['ok']}/{counts['hosts']} hosts ok: " +
+                 ", ".join(f"{name} {n}" for name, n in counts["return_codes"].items()))
+    return "\n".join(lines)
+
+
+def read_hosts(path: str) -> list[str]:
+    ''' Hosts listed in a file, one per line; # starts a comment. '''
+    with open(path) as fp:
+        return [line.split("#")[0].strip() for line in fp if line.split("#")[0].strip()]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='gpvpn fleet',
+                                     description='Sends a command to the gpvpn servers of many hosts at once.')
+    parser.add_argument('command', choices=list(FLEET_COMMANDS), help='Command to send to each server.')
+    parser.add_argument('hosts', nargs='*', help='Hosts, as name, name:port or tcp:// url.')
+    parser.add_argument('-H', '--hosts-file', help='Reads the hosts from this file, one per line.')
+    parser.add_argument('-f', '--config_file', help="Reads from this configuration file")
+    parser.add_argument('--concurrency', type=int, help='Servers queried at the same time (default fleet_concurrency).')
+    parser.add_argument('--timeout', type=float, help='Seconds to wait for each server (default fleet_timeout).')
+    parser.add_argument('--json', action='store_true', help='Print the replies as JSON, rather than as a table.')
+    args = parser.parse_args(argv)
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        hosts += read_hosts(args.hosts_file)
+    if not hosts:
+        parser.error("No hosts given.")
+    cfg = config.GPVpnAuthConfig()
+    if args.config_file is not None:
+        cfg.from_files([args.config_file])
+    command = FLEET_COMMANDS[args.command]
+
+    async def run() -> list[dict]:
+        return await Fleet(cfg, hosts, args.concurrency, args.timeout).run(command)
+    results = asyncio.run(run())
+    if args.json:
+        print(json.dumps(dict(command=args.command, summary=summary(results), hosts=results), indent=2))
+    else:
+        print(format_table(results))
+    return 0 if all(result["ok"] for result in results) else 1
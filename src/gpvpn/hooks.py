@@ -0,0 +1,210 @@
+import asyncio
+import dataclasses
+import logging
+import os
+import re
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+# Hooks are executables in <hooks_directory>/<event>.d, run by the server
+# on state transitions of the vpn connection: post-connect.d once the
+# tunnel is up, pre-disconnect.d before it goes down. Hooks run
+# concurrently, unless a hook names the hooks it has to wait for in a
+# line "# gpvpn-after: <name> ..." near its top.
+
+EVENTS = ("post-connect", "pre-disconnect")
+
+AFTER = re.compile(r"^#\s*gpvpn-after:(.*)$")
+
+
+@dataclasses.dataclass
+class HookResult:
+    name: str
+    status: str = "pending" # pending, running, ok, failed, timeout, cancelled, skipped
+    returncode: int | None = None
+    duration: float | None = None # seconds
+    output: str = "" # stdout and stderr, truncated
+    reason: str = "" # why the hook was skipped
+
+
+def find_hooks(directory: str) -> dict[str, list[str]]:
+    ''' The executables in directory, with the names of the hooks each waits for. '''
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return {}
+    hooks = {}
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.startswith(".") or name.endswith("~") or not os.path.isfile(path) or not os.access(path, os.X_OK):
+            continue
+        hooks[name] = read_dependencies(path)
+    return hooks
+
+
+def read_dependencies(path: str, lines: int = 10) -> list[str]:
+    after = []
+    try:
+        with open(path, errors="replace") as fp:
+            for _, line in zip(range(lines), fp):
+                match = AFTER.match(line.strip())
+                if match:
+                    after += match.group(1).split()
+    except OSError:
+        pass
+    return after
+
+
+class HookRunner:
+    OUTPUT_LIMIT=4096 # characters of output kept per hook
+
+    def __init__(self, concurrency: int = 4, timeout: float = 30) -> None:
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def run(self,
+                  directory: str,
+                  env: dict[str, str] | None = None,
+                  results: dict[str, HookResult] | None = None) -> list[HookResult]:
+        ''' Runs the hooks in directory, at most concurrency at a time, each for at most timeout seconds.
+
+        A hook starts once the hooks it waits for have succeeded. It is
+        skipped if one of them did not succeed, is not there, or waits
+        for it in turn. The results are filled in as the hooks run, in
+        results if given.
+        '''
+        hooks = find_hooks(directory)
+        results = {} if results is None else results
+        results.update((name, HookResult(name)) for name in hooks)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks : dict[str, asyncio.Task] = {}
+        env = dict(os.environ, **(env or {}))
+
+        async def run_after_dependencies(name: str) -> None:
+            for dependency in hooks[name]:
+                if dependency not in hooks:
+                    results[name].status, results[name].reason = "skipped", f"{dependency} is not a hook"
+                    return
+                if dependency in tasks:
+                    await tasks[dependency]
+                if results[dependency].status != "ok":
+                    results[name].status, results[name].reason = "skipped", f"{dependency} {results[dependency].status}"
+                    return
+            async with semaphore:
+                await self.run_hook(os.path.join(directory, name), results[name], env)
+
+        cycles = find_cycles(hooks)
+        for name in hooks:
+            if name in cycles:
+                results[name].status, results[name].reason = "skipped", "circular dependency"
+        for name in hooks:
+            if name not in cycles:
+                tasks[name] = asyncio.create_task(run_after_dependencies(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return list(results.values())
+
+    async def run_hook(self, path: str, result: HookResult, env: dict[str, str]) -> None:
+        ''' Runs one hook in a process group of its own, so that a timeout kills its children too. '''
+        result.status = "running"
+        t0 = time.monotonic()
+        try:
+            process = await asyncio.create_subprocess_exec(path,
+                                                           stdin=asyncio.subprocess.DEVNULL,
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.STDOUT,
+                                                           env=env,
+                                                           start_new_session=True)
+        except OSError as e:
+            result.status, result.output = "failed", str(e)
+            return
+        output = b""
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+            result.status = "ok" if process.returncode == 0 else "failed"
+        except TimeoutError:
+            kill_process_group(process.pid)
+            output, _ = await process.communicate()
+            result.status = "timeout"
+        except asyncio.CancelledError:
+            kill_process_group(process.pid)
+            await process.wait()
+            result.status = "cancelled"
+            raise
+        finally:
+            result.duration = round(time.monotonic() - t0, 3)
+            result.returncode = process.returncode
+            result.output = output.decode(errors="replace")[-self.OUTPUT_LIMIT:]
+            logger.log(logging.INFO if result.status == "ok" else logging.WARNING,
+                       f"Hook {path}: {result.status} (code {result.returncode}) after {result.duration} s.")
+
+
+def kill_process_group(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def find_cycles(hooks: dict[str, list[str]]) -> set[str]:
+    ''' Hooks that wait for themselves, directly or through other hooks. '''
+    cycles = set()
+    for start in hooks:
+        stack, seen = list(hooks[start]), set()
+        while stack:
+            name = stack.pop()
+            if name == start:
+                cycles.add(start)
+                break
+            if name in seen or name not in hooks:
+                continue
+            seen.add(name)
+            stack += hooks[name]
+    return cycles
+
+
+class Hooks:
+    ''' Runs the hooks of the events in the background, and keeps the results of the latest run of each. '''
+    def __init__(self, directory: str, concurrency: int = 4, timeout: float = 30) -> None:
+        self.directory = directory
+        self.runner = HookRunner(concurrency, timeout)
+        self.runs : dict[str, dict] = {}
+        self.tasks : dict[str, asyncio.Task] = {}
+
+    def start(self, event: str, env: dict[str, str] | None = None) -> asyncio.Task:
+        ''' Starts the hooks of event, cancelling a run of the same event still in progress. '''
+        if event in self.tasks and not self.tasks[event].done():
+            self.tasks[event].cancel()
+        run = dict(state="running", started=time.time(), finished=None, results={})
+        self.runs[event] = run
+        self.tasks[event] = asyncio.create_task(self.run(event, run, env))
+        return self.tasks[event]
+
+    async def run(self, event: str, run: dict, env: dict[str, str] | None) -> list[HookResult]:
+        env = dict(env or {}, GPVPN_EVENT=event)
+        try:
+            results = await self.runner.run(os.path.join(self.directory, f"{event}.d"), env, run["results"])
+        except asyncio.CancelledError:
+            run["state"] = "cancelled"
+            raise
+        finally:
+            run["finished"] = time.time()
+        run["state"] = "done"
+        return results
+
+    async def cancel(self, event: str | None = None) -> None:
+        tasks = [task for name, task in self.tasks.items() if event in (None, name) and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def report(self) -> dict:
+        ''' The latest run of each event, with the results of the hooks so far. '''
+        return {event: dict(self.runs[event], results=[dataclasses.asdict(result) for result in self.runs[event]["results"].values()])
+                for event in EVENTS if event in self.runs}
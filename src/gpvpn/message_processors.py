@@ -1,29 +1,55 @@
 import abc
 import asyncio
+import dataclasses
 import enum
 import json
 import logging
 import typing
 import os
-import pathlib
+import shlex
+import time
 import psutil
 import zmq
 import zmq.asyncio
 
 from gpvpn.common import *
-from gpvpn.config import GPVpnConfig
+from gpvpn.config import GPVpnConfig, GPVpnSettings, ConfigWatcher
+from gpvpn.status_page import StatusPageWriter
+from gpvpn.monitor import TunnelMonitor
+from gpvpn.hooks import Hooks
 
 logger = logging.getLogger(__name__)
 
+def timeout_at_deadline(deadline: float | None) -> asyncio.Timeout:
+    ''' asyncio.timeout for a deadline given as unix time (None: no deadline). '''
+    if deadline is None:
+        return asyncio.timeout(None)
+    loop = asyncio.get_running_loop()
+    return asyncio.timeout_at(loop.time() + deadline - time.time())
+
+
 class MessageProcessorBase(abc.ABC):
 
     @abc.abstractmethod
-    async def process(self, message: str) -> str:
+    async def process(self, message: str, peer: Peer | None = None) -> str:
+        ''' Handles a request, sent by peer (None if not known). '''
         ...
 
+    def background_tasks(self) -> list[typing.Coroutine]:
+        ''' Coroutines that the server runs alongside its listen loop. '''
+        return []
+
+    async def shutdown(self) -> dict:
+        ''' Cleans up when the server shuts down. Returns a report of what was done. '''
+        return {}
+
+    def reload(self) -> None:
+        ''' Rereads the configuration (SIGHUP). '''
+        pass
+
 class MessageProcessorReverse(MessageProcessorBase):
     
-    async def process(self, json_message: str) -> str:
+    async def process(self, json_message: str, peer: Peer | None = None) -> str:
         d = deserialise(json_message)
         command_str = d["command_code"]
         command_str = command_str[::-1]
@@ -33,38 +59,97 @@ class MessageProcessorReverse(MessageProcessorBase):
 
 
 class MessageProcessorVPNController(MessageProcessorBase):
-    WAIT_FOR_LOCKFILE=5 # wait this many seconds after start the gpclient to check for any lockfile.
+    WAIT_FOR_LOCKFILE=5 # wait at most this many seconds after start the gpclient for the lockfile.
+    LOCKFILE_POLL_INTERVAL=0.1 # check for the lockfile this often (seconds).
+    STATUS_PAGE_INTERVAL=5 # refresh the status page this often (seconds), see status_page.MAX_AGE.
+    TERMINATE_TIMEOUT=5 # seconds to wait for gpclient to exit after SIGTERM, before killing it.
+    CONFIG_POLL_INTERVAL=5 # check the configuration files for changes this often (seconds).
+    RECONNECTS=3 # times gpclient is restarted for a degraded link, per connect.
     
-    def __init__(self, cnf: GPVpnCongfig or None) -> None:
+    def __init__(self,
+                 cnf: GPVpnCongfig or None,
+                 status_page: str | None = STATUS_PAGE,
+                 config_watcher: ConfigWatcher | None = None) -> None:
         if cnf is None:
             cnf = GPCvpnConfig()
             cnf.from_files()
         self.cnf = cnf
-        self.lockfile = str(pathlib.PosixPath(cnf.lock_directory) / cnf.lock_filename)
-        self.logfile = str(pathlib.PosixPath(cnf.log_directory) / cnf.log_filename)
-        self.vpn_command = [cnf.vpnclient_path,
-                            cnf.vpnclient_options,
-                            cnf.vpnclient_command,
-                            cnf.vpnclient_command_options,
-                            cnf.vpnclient_url]
+        self.settings: GPVpnSettings = cnf.snapshot() # used by future connects
+        self.session: GPVpnSettings | None = None # used by the running gpclient
+        self.owner: int | None = None # uid of the user who started the running gpclient
+        self.logincode: str | None = None # of the running gpclient, for reconnects
+        self.config_watcher = config_watcher
         self.subprocess: asyncio.subprocess.Process | None = None
-
+        self.state: enum.Enum | None = None
+        self.since = 0.0
+        self.status_page = StatusPageWriter(status_page) if status_page else None
+        self.monitor = TunnelMonitor.from_config(cnf)
+        self.reconnect_on_degradation = self.monitor is not None and cnf.monitor_reconnect
+        self.reconnects = 0
+        self.reconnect_task: asyncio.Task | None = None
+        # connects and disconnects, by request or by the monitor, one at a time.
+        self.transition = asyncio.Lock()
+        if self.monitor is not None:
+            self.monitor.listeners.append(self.on_link_event)
+        self.hooks = Hooks(cnf.hooks_directory, cnf.hook_concurrency, cnf.hook_timeout)
         
+    @property
+    def active_settings(self) -> GPVpnSettings:
+        ''' The settings of the running gpclient, if any, else the current settings. '''
+        return self.session or self.settings
+
+    @property
+    def lockfile(self) -> str:
+        return self.active_settings.lockfile
+
+    @lockfile.setter
+    def lockfile(self, lockfile: str) -> None:
+        self.settings = dataclasses.replace(self.settings, lockfile=lockfile)
+
+    @property
+    def logfile(self) -> str:
+        return self.active_settings.logfile
+
+    @property
+    def vpn_command(self) -> tuple:
+        return self.settings.vpn_command
+
+    def use_settings(self, settings: GPVpnSettings) -> None:
+        ''' Swaps in new settings for future connects. A running gpclient keeps its own. '''
+        if settings == self.settings:
+            logger.info("Configuration unchanged.")
+            return
+        for f in dataclasses.fields(settings):
+            old, new = getattr(self.settings, f.name), getattr(settings, f.name)
+            if old != new:
+                logger.info(f"Configuration change: {f.name} {old!r} -> {new!r}.")
+        self.settings = settings
+        if self.session is not None:
+            logger.info("The running vpn connection keeps its settings until it is disconnected.")
+
+    def reload(self) -> None:
+        if self.config_watcher is None:
+            logger.warning("Reload requested, but the configuration is not watched.")
+            return
+        settings = self.config_watcher.poll()
+        if settings is not None:
+            self.use_settings(settings)
+
+    async def watch_config_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.CONFIG_POLL_INTERVAL)
+            self.reload()
+
     def parse(self, message: str) -> enum.Enum:
         i = int(message)
         command = COMMANDS._value2member_map_[i]
         return command
 
     
-    async def run_detached_program(self, command: list[str]) -> asyncio.subprocess.Process:
+    async def run_detached_program(self, command: typing.Sequence[str], logfile: str) -> asyncio.subprocess.Process:
         # Create the subprocess in a new session
-        _command = list(command)
-        command.clear()
-        for _c in _command:
-            _cs = _c.split()
-            command += _cs
-        logger.debug(f"Executing {" ".join(command)}")
-        with open(self.logfile, 'w') as fp:
+        logger.debug(f"Executing {shlex.join(command)}")
+        with open(logfile, 'w') as fp:
             process = await asyncio.create_subprocess_exec(
                 *command,
                 stdin=asyncio.subprocess.PIPE,
@@ -89,8 +174,7 @@ class MessageProcessorVPNController(MessageProcessorBase):
                 pid = -1
         return pid
     
-    @serialise
-    async def check_status(self) -> enum.Enum:
+    def lockfile_state(self) -> enum.Enum:
         logger.debug(f"Checking status: {self.lockfile}: {os.path.exists(self.lockfile)}")
         # check whether lock file exists:
         if os.path.exists(self.lockfile): 
@@ -103,65 +187,306 @@ class MessageProcessorVPNController(MessageProcessorBase):
                 os.unlink(self.lockfile)
         else:
             return_code = RETURNCODES.Inactive
-        logger.debug(f"Returning {return_code} in check status")
         return return_code
 
+    def track_state(self, return_code: enum.Enum) -> None:
+        ''' Remembers since when the connection is in its current state. '''
+        if return_code == self.state:
+            return
+        self.state = return_code
+        self.since = time.time()
+        if return_code == RETURNCODES.Active:
+            # the tunnel may have been up before the server (re)started.
+            try:
+                self.since = os.stat(self.lockfile).st_mtime
+            except FileNotFoundError:
+                pass
+
+    def state_after(self, command: enum.Enum, return_code: int) -> enum.Enum | None:
+        ''' Connection state implied by the reply to a command, if any. '''
+        match return_code:
+            case RETURNCODES.Active | RETURNCODES.AlreadyConnected:
+                return RETURNCODES.Active
+            case RETURNCODES.Inactive | RETURNCODES.AlreadyDisconnected:
+                return RETURNCODES.Inactive
+            case RETURNCODES.Success:
+                return RETURNCODES.Active if command == COMMANDS.Open else RETURNCODES.Inactive
+        return None
+
+    def publish_status(self, return_code: enum.Enum | None = None) -> None:
+        if self.status_page is None or self.status_page.mmap is None:
+            return
+        if return_code is None:
+            return_code = self.lockfile_state()
+        self.track_state(return_code)
+        if return_code == RETURNCODES.Active:
+            pid = self.get_pid_from_lockfile(self.lockfile)
+        else:
+            pid = -1
+        self.status_page.publish(return_code, pid, self.since, self.active_settings.gateway)
+
+    async def publish_status_loop(self) -> None:
+        try:
+            self.status_page.open()
+        except OSError as e:
+            logger.error(f"Could not create status page {self.status_page.path} ({e}).")
+            return
+        try:
+            while True:
+                self.publish_status()
+                await asyncio.sleep(self.STATUS_PAGE_INTERVAL)
+        finally:
+            self.status_page.close()
+
+    def background_tasks(self) -> list[typing.Coroutine]:
+        tasks = []
+        if self.status_page is not None:
+            tasks.append(self.publish_status_loop())
+        if self.config_watcher is not None:
+            tasks.append(self.watch_config_loop())
+        if self.monitor is not None:
+            tasks.append(self.monitor.run(self.tunnel_active))
+        return tasks
+
+    def tunnel_active(self) -> bool:
+        return self.lockfile_state() == RETURNCODES.Active
+
+    def on_link_event(self, event: dict) -> None:
+        if event["event"] != "degraded" or not self.reconnect_on_degradation:
+            return
+        if self.reconnect_task is not None and not self.reconnect_task.done():
+            return
+        if self.reconnects >= self.RECONNECTS:
+            logger.warning(f"Tunnel degraded, but gpclient was restarted {self.reconnects} times already.")
+            return
+        self.reconnects += 1
+        self.reconnect_task = asyncio.create_task(self.reconnect())
+
+    async def reconnect(self) -> RETURNCODES | None:
+        ''' Restarts gpclient with the login code of the running session.
+
+        Whether the gateway accepts the login code again depends on how
+        long its cookie is valid.
+        '''
+        async with self.transition:
+            if self.subprocess is None or self.logincode is None:
+                logger.warning("Tunnel degraded, but it was not started by this server. Not reconnecting.")
+                return None
+            owner, logincode = self.owner, self.logincode
+            logger.warning(f"Restarting gpclient for a degraded tunnel ({self.reconnects}/{self.RECONNECTS}).")
+            await self.terminate_subprocess()
+            self.lockfile_state() # removes the lockfile of a killed gpclient
+            reply = deserialise(await self.connect_vpn(logincode, None, None if owner is None else Peer(uid=owner)))
+            return_code = RETURNCODES(reply["return_code"])
+            logger.info(f"Reconnect: {return_code.name}.")
+            return return_code
+
+    def release_exited_subprocess(self) -> None:
+        ''' Drops the reference to a gpclient that has exited by itself, such as after a crash. '''
+        if self.subprocess is not None and self.subprocess.returncode is not None:
+            logger.debug(f"gpclient (pid {self.subprocess.pid}) exited with code {self.subprocess.returncode}.")
+            self.subprocess = None
+        if self.subprocess is None:
+            self.forget_session()
+
+    def forget_session(self) -> None:
+        self.subprocess = None
+        self.session = None
+        self.owner = None
+        self.logincode = None
+
+    def may_end_session(self, peer: Peer | None) -> bool:
+        ''' Whether peer may disconnect the running gpclient: its owner and root may.
+
+        Sessions of which the owner is not known (started before the
+        server started, or by hand) may be ended by anyone.
+        '''
+        return peer is None or self.owner is None or peer.uid in (0, self.owner)
+
+    def owner_details(self, peer: Peer | None) -> dict:
+        if self.owner is None:
+            return dict(owner=None)
+        details = dict(owner=user_name(self.owner))
+        if peer is not None:
+            details["owned"] = peer.uid == self.owner
+        return details
+
+    def hook_environment(self) -> dict[str, str]:
+        ''' Tells hooks which connection they run for. '''
+        return dict(GPVPN_GATEWAY=self.active_settings.gateway,
+                    GPVPN_USER="" if self.owner is None else user_name(self.owner),
+                    GPVPN_LOGFILE=self.logfile)
+
+    @serialise
+    async def check_status(self, peer: Peer | None = None) -> enum.Enum:
+        self.release_exited_subprocess()
+        return_code = self.lockfile_state()
+        self.track_state(return_code)
+        logger.debug(f"Returning {return_code} in check status")
+        details = dict(gateway=self.active_settings.gateway,
+                       since=self.since,
+                       **self.owner_details(peer))
+        if self.monitor is not None and return_code == RETURNCODES.Active:
+            details["quality"] = self.monitor.statistics()
+        return return_code, details
+
     
+    async def wait_for_lockfile(self) -> enum.Enum:
+        ''' Waits up to WAIT_FOR_LOCKFILE seconds for gpclient to write its lockfile. '''
+        loop = asyncio.get_running_loop()
+        end_time = loop.time() + self.WAIT_FOR_LOCKFILE
+        while not os.path.exists(self.lockfile): # Should we also analyse the output of route?
+            if self.subprocess.returncode is not None:
+                logger.debug(f"gpclient exited with code {self.subprocess.returncode} before writing its lockfile.")
+                return RETURNCODES.Failed
+            if loop.time() >= end_time:
+                return RETURNCODES.Failed
+            await asyncio.sleep(self.LOCKFILE_POLL_INTERVAL)
+        return RETURNCODES.Success
+
     @serialise
-    async def connect_vpn(self, logincode: str) -> enum.Enum:
+    async def connect_vpn(self, logincode: str, deadline: float | None = None, peer: Peer | None = None) -> enum.Enum:
         if os.path.exists(self.lockfile): # Should we also analyse the output of route?
-            return RETURNCODES.AlreadyConnected
+            return RETURNCODES.AlreadyConnected, self.owner_details(peer)
+        self.release_exited_subprocess()
+        # the new gpclient runs with the settings of this moment, whatever reloads follow.
+        self.session = self.settings
+        self.owner = None if peer is None else peer.uid
         logger.debug("launching vpn command...")
-        logger.debug(f"vpn_command {self.vpn_command}.")
-        self.subprocess = await self.run_detached_program(self.vpn_command)
-        logger.debug("vpn command launched.")
-        # communicate the logincode
-        self.subprocess.stdin.write(logincode.encode())
-        await self.subprocess.stdin.drain()
-        self.subprocess.stdin.close() # close stdin, so our program knows there is nothing to be expected.
-        logger.debug(f"Login code submitted. (Should be echoed in log file ({self.logfile}).)")
-        await asyncio.sleep(self.WAIT_FOR_LOCKFILE) # is this long enough for gpclient program?
-        if os.path.exists(self.lockfile): # Should we also analyse the output of route?
-            return_code = RETURNCODES.Success
-        else:
-            return_code = RETURNCODES.Failed
+        logger.debug(f"vpn_command {self.session.vpn_command}.")
+        # the spawn is not cancelled halfway: we need the process to clean up after a timeout.
+        spawn = asyncio.ensure_future(self.run_detached_program(self.session.vpn_command, self.session.logfile))
+        try:
+            async with timeout_at_deadline(deadline):
+                self.subprocess = await asyncio.shield(spawn)
+                logger.debug("vpn command launched.")
+                # communicate the logincode
+                self.subprocess.stdin.write(logincode.encode())
+                await self.subprocess.stdin.drain()
+                self.subprocess.stdin.close() # close stdin, so our program knows there is nothing to be expected.
+                logger.debug(f"Login code submitted. (Should be echoed in log file ({self.logfile}).)")
+                return_code = await self.wait_for_lockfile()
+                self.release_exited_subprocess()
+                if return_code == RETURNCODES.Success:
+                    self.logincode = logincode
+                    if self.monitor is not None:
+                        self.monitor.reset()
+                    # the reply does not wait for the hooks; see the Hooks command for their results.
+                    self.hooks.start("post-connect", self.hook_environment())
+        except TimeoutError:
+            logger.warning("Deadline exceeded while connecting. Stopping the half-started gpclient.")
+            self.subprocess = await spawn
+            await self.terminate_subprocess()
+            return_code = RETURNCODES.DeadlineExceeded
         return return_code
 
     @serialise
-    async def disconnect_vpn(self) -> enum.Enum:
+    async def disconnect_vpn(self, deadline: float | None = None, peer: Peer | None = None) -> enum.Enum:
+        self.release_exited_subprocess()
         if not os.path.exists(self.lockfile):
             return RETURNCODES.AlreadyDisconnected
+        if not self.may_end_session(peer):
+            logger.warning(f"{peer} tried to disconnect the vpn connection of {user_name(self.owner)}.")
+            return RETURNCODES.NotOwner, self.owner_details(peer)
         if self.subprocess is None:
             # we have a running process possibly, but no
             # subprocess. Possibly started by hand. Kill it "manually"
             # too.
             return_code=RETURNCODES.RunningWithoutSubprocess
         else:
+            # the hooks run while the tunnel is still up, each for at most hook_timeout seconds.
+            await self.hooks.cancel("post-connect")
+            try:
+                async with timeout_at_deadline(deadline):
+                    await self.hooks.start("pre-disconnect", self.hook_environment())
+            except TimeoutError:
+                logger.warning("Deadline exceeded while running the pre-disconnect hooks. Disconnecting anyway.")
             self.subprocess.terminate()
-            exit_code = await self.subprocess.wait()
+            try:
+                async with timeout_at_deadline(deadline):
+                    exit_code = await self.subprocess.wait()
+            except TimeoutError:
+                logger.warning(f"Deadline exceeded while waiting for gpclient (pid {self.subprocess.pid}) to exit.")
+                return RETURNCODES.DeadlineExceeded
+            self.forget_session()
             return_code=RETURNCODES.Success
         return return_code
-            
+
+    async def terminate_subprocess(self) -> int | None:
+        ''' Terminates the gpclient started by this server, killing it if needed.
+
+        Returns the pid of the terminated process, if any.
+        '''
+        if self.subprocess is None:
+            return None
+        pid = None
+        if self.subprocess.returncode is None:
+            pid = self.subprocess.pid
+            logger.info(f"Terminating gpclient (pid {pid}).")
+            try:
+                self.subprocess.terminate()
+                await asyncio.wait_for(self.subprocess.wait(), self.TERMINATE_TIMEOUT)
+            except ProcessLookupError:
+                pass
+            except TimeoutError:
+                logger.warning(f"gpclient (pid {pid}) did not terminate. Killing it.")
+                self.subprocess.kill()
+            await self.subprocess.wait()
+        self.forget_session()
+        return pid
+
+    async def shutdown(self) -> dict:
+        ''' Terminates the gpclient started by this server and removes a stale lockfile. '''
+        report = {}
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            await asyncio.gather(self.reconnect_task, return_exceptions=True)
+        await self.hooks.cancel()
+        if self.subprocess is not None and self.subprocess.returncode is None:
+            await self.hooks.start("pre-disconnect", self.hook_environment())
+        pid = await self.terminate_subprocess()
+        if pid is not None:
+            report["terminated_subprocess"] = pid
+        had_lockfile = os.path.exists(self.lockfile)
+        self.lockfile_state() # removes a stale lockfile
+        report["removed_stale_lockfile"] = had_lockfile and not os.path.exists(self.lockfile)
+        return report
+
     @serialise
-    async def quit_application(self) -> enum.Enum:
+    async def quit_application(self, peer: Peer | None = None) -> enum.Enum:
+        # stopping the server stops the gpclient it started.
+        self.release_exited_subprocess()
+        if self.subprocess is not None and not self.may_end_session(peer):
+            logger.warning(f"{peer} tried to stop the server, ending the vpn connection of {user_name(self.owner)}.")
+            return RETURNCODES.NotOwner, self.owner_details(peer)
         return RETURNCODES.QuitApplication
     
-    async def process(self, message: str) -> str:
+    async def process(self, message: str, peer: Peer | None = None) -> str:
         message_dict = deserialise(message)
         command_code = message_dict["command_code"]
+        deadline = message_dict.get("deadline")
         command = self.parse(command_code)
         match command:
             case COMMANDS.Status:
-                return_message = await self.check_status()
+                return_message = await self.check_status(peer)
             case COMMANDS.Open:
                 logger.debug(f"Going to connect vpn using {message_dict["logincode"]}")
-                return_message = await self.connect_vpn(message_dict["logincode"])
+                async with self.transition:
+                    self.reconnects = 0
+                    return_message = await self.connect_vpn(message_dict["logincode"], deadline, peer)
             case COMMANDS.Close:
-                return_message = await self.disconnect_vpn()
+                async with self.transition:
+                    return_message = await self.disconnect_vpn(deadline, peer)
             case COMMANDS.Quit:
-                return_message = await self.quit_application()
+                return_message = await self.quit_application(peer)
+            case COMMANDS.Hooks:
+                return_message = json.dumps(dict(return_code=RETURNCODES.Success, **self.hooks.report()))
             case _:
                 raise ValueError(f"Unknown command ({command}). Should not occur.")
+        if self.status_page is not None and self.status_page.mmap is not None:
+            state = self.state_after(command, deserialise(return_message)["return_code"])
+            if state is not None:
+                self.publish_status(state)
         return return_message
 
     
@@ -0,0 +1,205 @@
+import asyncio
+import dataclasses
+import logging
+import os
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Quality of the tunnel, as seen by probes to an endpoint inside the
+# vpn: a TCP connect, or a UDP datagram returned by an echo service. The
+# lockfile tells that gpclient runs, not that the tunnel carries traffic.
+
+
+@dataclasses.dataclass(frozen=True)
+class Sample:
+    time: float # unix time of the probe
+    rtt: float | None # seconds; None if the probe got no answer
+
+
+class RingBuffer:
+    ''' The last size items added, in a list allocated once. '''
+    def __init__(self, size: int) -> None:
+        self.items : list = [None] * size
+        self.size = size
+        self.count = 0 # items added so far
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+    def append(self, item: typing.Any) -> None:
+        self.items[self.count % self.size] = item
+        self.count += 1
+
+    def last(self, n: int | None = None) -> list:
+        ''' The last n items (default: all), oldest first. '''
+        n = len(self) if n is None else min(n, len(self))
+        return [self.items[i % self.size] for i in range(self.count - n, self.count)]
+
+    def clear(self) -> None:
+        self.items = [None] * self.size
+        self.count = 0
+
+
+def window_statistics(samples: list[Sample]) -> dict:
+    ''' Loss, round trip times and jitter (ms) of the samples.
+
+    Jitter is the mean difference between the round trip times of
+    consecutive answered probes.
+    '''
+    rtts = [sample.rtt * 1e3 for sample in samples if sample.rtt is not None]
+    statistics = dict(probes=len(samples),
+                      lost=len(samples) - len(rtts),
+                      loss=(len(samples) - len(rtts)) / len(samples) if samples else None,
+                      rtt_min=None, rtt_avg=None, rtt_max=None, jitter=None,
+                      last=samples[-1].time if samples else None)
+    if rtts:
+        statistics.update(rtt_min=round(min(rtts), 3),
+                          rtt_avg=round(sum(rtts) / len(rtts), 3),
+                          rtt_max=round(max(rtts), 3))
+    if len(rtts) > 1:
+        statistics["jitter"] = round(sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1), 3)
+    return statistics
+
+
+async def tcp_probe(host: str, port: int, timeout: float) -> float | None:
+    ''' Time to open a TCP connection to host:port, or None if it failed within timeout. '''
+    t0 = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, TimeoutError):
+        return None
+    rtt = time.perf_counter() - t0
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return rtt
+
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self, payload: bytes) -> None:
+        self.payload = payload
+        self.answered = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data: bytes, address: typing.Any) -> None:
+        if data == self.payload and not self.answered.done():
+            self.answered.set_result(time.perf_counter())
+
+
+async def udp_probe(host: str, port: int, timeout: float) -> float | None:
+    ''' Round trip time of a datagram to a UDP echo service, or None if it did not come back within timeout. '''
+    loop = asyncio.get_running_loop()
+    payload = os.urandom(16)
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(lambda: EchoProtocol(payload),
+                                                                  remote_addr=(host, port))
+    except OSError:
+        return None
+    try:
+        t0 = time.perf_counter()
+        transport.sendto(payload)
+        return await asyncio.wait_for(protocol.answered, timeout) - t0
+    except (OSError, TimeoutError):
+        return None
+    finally:
+        transport.close()
+
+
+class TunnelMonitor:
+    SIZE=256 # probes kept
+    EVENTS=16 # degradation and recovery events kept
+    MIN_PROBES=3 # probes in the window before the link is judged
+
+    def __init__(self,
+                 probe: typing.Callable[[], typing.Awaitable[float | None]],
+                 target: str = "",
+                 interval: float = 10,
+                 window: int = 30,
+                 max_loss: float = 0.2,
+                 max_rtt: float = 500) -> None:
+        ''' Probes every interval seconds, judging the last window probes.
+
+        The link is degraded when more than max_loss (fraction) of the
+        probes are lost, or when their mean round trip time exceeds
+        max_rtt (ms).
+        '''
+        self.probe = probe
+        self.target = target
+        self.interval = interval
+        self.window = window
+        self.max_loss = max_loss
+        self.max_rtt = max_rtt
+        self.samples = RingBuffer(self.SIZE)
+        self.events = RingBuffer(self.EVENTS)
+        self.degraded = False
+        self.listeners : list[typing.Callable[[dict], None]] = [] # called with each event
+
+    @classmethod
+    def from_config(cls, cnf: typing.Any) -> typing.Self | None:
+        ''' The monitor configured by monitor_* in the server configuration, if any. '''
+        if not cnf.monitor_target:
+            return None
+        host, _, port = cnf.monitor_target.rpartition(":")
+        probes = dict(tcp=tcp_probe, udp=udp_probe)
+        if cnf.monitor_protocol not in probes or not host or not port.isdigit():
+            logger.error(f"Invalid monitor_target {cnf.monitor_target} or monitor_protocol {cnf.monitor_protocol}. "
+                         "Not monitoring the tunnel.")
+            return None
+        probe = probes[cnf.monitor_protocol]
+        timeout = cnf.monitor_timeout
+        return cls(lambda: probe(host, int(port), timeout),
+                   target=f"{cnf.monitor_protocol}://{cnf.monitor_target}",
+                   interval=cnf.monitor_interval,
+                   window=cnf.monitor_window,
+                   max_loss=cnf.monitor_max_loss,
+                   max_rtt=cnf.monitor_max_rtt)
+
+    def statistics(self) -> dict:
+        return dict(target=self.target,
+                    degraded=self.degraded,
+                    **window_statistics(self.samples.last(self.window)),
+                    events=self.events.last())
+
+    def reset(self) -> None:
+        ''' Forgets the probes of a previous tunnel. '''
+        self.samples.clear()
+        self.degraded = False
+
+    def judge(self, statistics: dict) -> bool:
+        if statistics["probes"] < self.MIN_PROBES:
+            return self.degraded
+        if statistics["loss"] > self.max_loss:
+            return True
+        return statistics["rtt_avg"] is not None and statistics["rtt_avg"] > self.max_rtt
+
+    def add(self, sample: Sample) -> dict | None:
+        ''' Records a probe. Returns the event, if the link degraded or recovered. '''
+        self.samples.append(sample)
+        statistics = window_statistics(self.samples.last(self.window))
+        degraded = self.judge(statistics)
+        if degraded == self.degraded:
+            return None
+        self.degraded = degraded
+        event = dict(event="degraded" if degraded else "recovered",
+                     time=sample.time,
+                     loss=statistics["loss"],
+                     rtt_avg=statistics["rtt_avg"],
+                     jitter=statistics["jitter"])
+        self.events.append(event)
+        if degraded:
+            logger.warning(f"Tunnel to {self.target} degraded: {event}.")
+        else:
+            logger.info(f"Tunnel to {self.target} recovered: {event}.")
+        for listener in self.listeners:
+            listener(event)
+        return event
+
+    async def run(self, active: typing.Callable[[], bool]) -> None:
+        ''' Probes while active() tells that the tunnel is up. '''
+        while True:
+            if active():
+                self.add(Sample(time.time(), await self.probe()))
+            await asyncio.sleep(self.interval)
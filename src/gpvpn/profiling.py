@@ -0,0 +1,96 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# On-demand profiling of the running server. Nothing is profiled or
+# traced until a session is started (SIGUSR1, or the Profile command), so
+# there is no overhead otherwise.
+
+
+def dump_task_stacks(fp: io.TextIOBase) -> None:
+    ''' Writes the stack of every asyncio task of the running loop. '''
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    fp.write(f"{len(tasks)} asyncio tasks\n\n")
+    for task in tasks:
+        fp.write(f"{task!r}\n")
+        task.print_stack(file=fp)
+        fp.write("\n")
+
+
+class Profiler:
+    DURATION=10 # default length of a profiling session (seconds).
+    MAX_DURATION=300 # sessions are never longer than this (seconds).
+    TOP=30 # functions and allocation sites in the text reports.
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.task: asyncio.Task | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def paths(self, stamp: str) -> dict[str, str]:
+        names = dict(tasks="tasks.txt",
+                     profile="profile.prof",
+                     profile_report="profile.txt",
+                     tracemalloc="tracemalloc.txt")
+        return {key: os.path.join(self.directory, f"gpvpn-{stamp}-{name}") for key, name in names.items()}
+
+    def start(self, duration: float | None = None) -> dict | None:
+        ''' Starts a profiling session in the background.
+
+        Returns the files the session writes, or None if a session is
+        running already.
+        '''
+        if self.active:
+            logger.warning("A profiling session is running already.")
+            return None
+        duration = min(self.DURATION if duration is None else duration, self.MAX_DURATION)
+        paths = self.paths(time.strftime("%Y%m%dT%H%M%S"))
+        self.task = asyncio.create_task(self.session(duration, paths))
+        return dict(duration=duration, **paths)
+
+    async def stop(self) -> None:
+        if self.active:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def session(self, duration: float, paths: dict[str, str]) -> None:
+        ''' Dumps the task stacks, then profiles and traces allocations for duration seconds. '''
+        logger.info(f"Profiling for {duration} s, writing to {self.directory}.")
+        with open(paths["tasks"], 'w') as fp:
+            dump_task_stacks(fp)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e: # another profiler, such as a debugger, is active.
+            logger.error(f"Could not start profiling ({e}).")
+            return
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            # cancelled sessions (server shutdown) still write what they have.
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            profile.dump_stats(paths["profile"])
+            with open(paths["profile_report"], 'w') as fp:
+                pstats.Stats(profile, stream=fp).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.TOP)
+            with open(paths["tracemalloc"], 'w') as fp:
+                fp.write(f"Top {self.TOP} allocation sites by growth during the session\n\n")
+                for statistic in after.compare_to(before, "lineno")[:self.TOP]:
+                    fp.write(f"{statistic}\n")
+            logger.info(f"Profiling session done: {paths}.")
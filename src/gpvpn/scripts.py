@@ -3,8 +3,9 @@ import argparse
 import json
 import logging
 import sys
+import time
 
-from . import server, message_processors, config
+from . import server, message_processors, config, status_page, systemd, profiling, fleet, monitor, hooks
 from .common import *
 
 def server_app():
@@ -13,26 +14,91 @@ def server_app():
     server.logger.setLevel(log_level)
     config.logger.setLevel(log_level)
     message_processors.logger.setLevel(log_level)
-    cfg = config.GPVpnConfig().from_files()
-    message_processor = message_processors.MessageProcessorVPNController(cfg)
-    s = server.IPCServer(message_processor=message_processor)
+    systemd.logger.setLevel(log_level)
+    profiling.logger.setLevel(log_level)
+    monitor.logger.setLevel(log_level)
+    hooks.logger.setLevel(log_level)
+    config_watcher = config.ConfigWatcher()
+    cfg = config_watcher.load()
+    try:
+        cfg.snapshot().validate()
+    except config.ConfigError as e:
+        config.logger.error(str(e))
+        sys.exit(1)
+    message_processor = message_processors.MessageProcessorVPNController(cfg, config_watcher=config_watcher)
+    s = server.IPCServer(message_processor=message_processor,
+                         handle_signals=True,
+                         profile_directory=cfg.log_directory,
+                         tcp_url=cfg.tcp_url or None,
+                         curve_directory=cfg.curve_directory)
     s.open()
     asyncio.run(s.run())
 
 
+def status_details(result: dict) -> str:
+    ''' Gateway, state change time, owner and link quality, as far as reported by the server. '''
+    if "gateway" not in result or "since" not in result:
+        return ""
+    since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(result['since']))
+    owner = f", opened by {result['owner']}" if result.get("owner") else ""
+    return f" (gateway {result['gateway']}, since {since}{owner}){quality_details(result.get('quality'))}"
+
+
+def quality_details(quality: dict | None) -> str:
+    ''' Round trip time, jitter and loss measured by the tunnel monitor. '''
+    if not quality or not quality["probes"]:
+        return ""
+    details = f"\nLink to {quality['target']}: loss {quality['loss']:.0%}"
+    if quality["rtt_avg"] is not None:
+        details += f", rtt {quality['rtt_avg']:.1f} ms"
+    if quality["jitter"] is not None:
+        details += f", jitter {quality['jitter']:.1f} ms"
+    if quality["degraded"]:
+        details += " (degraded)"
+    return details
+
+
+def hook_details(result: dict) -> str:
+    ''' The outcome of each hook of the latest post-connect and pre-disconnect runs. '''
+    lines = []
+    for event in hooks.EVENTS:
+        run = result.get(event)
+        if run is None:
+            continue
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run['started']))
+        lines.append(f"{event} ({run['state']}, started {started}):")
+        if not run["results"]:
+            lines.append("  no hooks")
+        for hook in run["results"]:
+            duration = "" if hook["duration"] is None else f" after {hook['duration']:.1f} s"
+            reason = f": {hook['reason']}" if hook["reason"] else ""
+            lines.append(f"  {hook['name']}: {hook['status']}{duration}{reason}")
+            lines += [f"    {line}" for line in hook["output"].splitlines()]
+    return "\n".join(lines) or "No hooks have run"
+
+
 def client_app():
     logging.basicConfig(level=logging.WARNING)
+    if sys.argv[1:2] == ["fleet"]:
+        # gpvpn fleet <command> <host>... has arguments of its own.
+        sys.exit(fleet.main(sys.argv[2:]))
 
     parser = argparse.ArgumentParser(prog='gpvpn',
                                      description='Global Connect VPN contoller',
                                      epilog='')
     parser.add_argument('command',
-                        choices=['status', 's', 'connect', 'c', 'disconnect', 'd', 'stop_server'],
-                        help='Commands to control the vpn status.')
+                        choices=['status', 's', 'connect', 'c', 'disconnect', 'd', 'stop_server', 'statistics', 'profile', 'hooks', 'fleet'],
+                        help='Commands to control the vpn status. See gpvpn fleet --help for controlling many hosts.')
     parser.add_argument('-f', '--config_file', help="Reads from this configuration file")
+    parser.add_argument('--fast', action='store_true',
+                        help='Read the status from the status page published by the server, instead of asking the server.')
+    parser.add_argument('--duration', type=float,
+                        help=f'Length of a profiling session in seconds (default {profiling.Profiler.DURATION}).')
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='Increase verbosity (use -v, -vv, or -v -v)')
     args = parser.parse_args()
+    if args.fast and args.command not in ('status', 's'):
+        parser.error("--fast can only be used with the status command.")
 
     match args.verbose:
         case 0:
@@ -47,6 +113,7 @@ def client_app():
     server.logger.setLevel(log_level)
     config.logger.setLevel(log_level)
     message_processors.logger.setLevel(log_level)
+    status_page.logger.setLevel(log_level)
         
     match args.command:
         case "status" | "s":
@@ -57,20 +124,53 @@ def client_app():
             s = COMMANDS.Close
         case "stop_server":
             s = COMMANDS.Quit
+        case "statistics":
+            s = COMMANDS.Statistics
+        case "profile":
+            s = COMMANDS.Profile
+        case "hooks":
+            s = COMMANDS.Hooks
     command = args.command
     cfg = config.GPVpnAuthConfig()
     if not  args.config_file is None:
         cfg.from_files([args.config_file])
-    with server.IPCClient(cfg) as client:
-        result = asyncio.run(client.send_request(s))
+    if s == COMMANDS.Open:
+        # fail now, rather than after the server was asked to connect.
+        try:
+            cfg.validate()
+        except config.ConfigError as e:
+            print(e)
+            sys.exit(1)
+    result = None
+    if args.fast:
+        result = status_page.read_status_page(STATUS_PAGE)
+        if result is None:
+            status_page.logger.info(f"Status page {STATUS_PAGE} is missing or stale. Asking the server instead.")
+    if result is None:
+        fields = dict(duration=args.duration) if s == COMMANDS.Profile and args.duration else {}
+        with server.IPCClient(cfg) as client:
+            result = asyncio.run(client.send_request(s, **fields))
     return_code = result['return_code']
+    if s == COMMANDS.Statistics and return_code == RETURNCODES.Success:
+        for k, v in result.items():
+            if k != 'return_code':
+                print(f"{k}: {v}")
+        return
+    if s == COMMANDS.Hooks and return_code == RETURNCODES.Success:
+        print(hook_details(result))
+        return
+    if s == COMMANDS.Profile and return_code == RETURNCODES.Success:
+        print(f"Profiling the server for {result['duration']} s. Results are written to:")
+        for k in ('tasks', 'profile', 'profile_report', 'tracemalloc'):
+            print(f"  {result[k]}")
+        return
     match return_code:
         case RETURNCODES.Active:
-            mesg = "VPN connection is active"
+            mesg = "VPN connection is active" + status_details(result)
         case RETURNCODES.Inactive:
-            mesg = "VPN connection is inactive"
+            mesg = "VPN connection is inactive" + status_details(result)
         case RETURNCODES.AlreadyConnected:
-            mesg = "VPN connection is already active"
+            mesg = "VPN connection is already active" + (f" (opened by {result['owner']})" if result.get("owner") else "")
         case RETURNCODES.AlreadyDisconnected:
             mesg = "VPN connection is already inactive"
         case RETURNCODES.Success:
@@ -81,10 +181,23 @@ def client_app():
         case RETURNCODES.Failed:
             if s == COMMANDS.Close:
                 mesg = "VPN connection could not be deactivated"
+            elif s == COMMANDS.Profile:
+                mesg = "gpvpn server cannot be profiled"
             else:
                 mesg = "VPN connection could not be activated"
         case RETURNCODES.QuitApplication:
             mesg = "gpvpn server killed"
+        case RETURNCODES.Busy:
+            if s == COMMANDS.Profile:
+                mesg = "gpvpn server is being profiled already. Try again later"
+            else:
+                mesg = "gpvpn server is busy. Try again later"
+        case RETURNCODES.NotPermitted:
+            mesg = "Only root may profile the gpvpn server"
+        case RETURNCODES.NotOwner:
+            mesg = f"VPN connection was opened by {result.get('owner')}. Only they or root may close it"
+        case RETURNCODES.DeadlineExceeded:
+            mesg = "gpvpn server did not complete the request in time"
         case RETURNCODES.CommandNotUnderstood:
             mesg = f"Command {args.command} was not understood. Try --help..."
         case _:
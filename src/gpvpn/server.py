@@ -1,46 +1,263 @@
 import abc
 import asyncio
+import collections
+import dataclasses
 import enum
+import itertools
 import json
 import logging
 import typing
 import os
+import signal
+import socket
 import stat
+import struct
 import sys
 import grp
+import tempfile
+import time
+import uuid
 
 import zmq
 import zmq.asyncio
+import zmq.auth
+from zmq.auth.thread import ThreadAuthenticator
+from zmq.utils.monitor import parse_monitor_message
 
 logger = logging.getLogger(__name__)
 
+from gpvpn import systemd
+from gpvpn.profiling import Profiler
 from gpvpn.config import GPVpnAuthConfig
 from gpvpn.message_processors import MessageProcessorBase
-from gpvpn.common import GROUPNAME, ERRORCODES, COMMANDS, RETURNCODES, deserialise
+from gpvpn.common import GROUPNAME, ERRORCODES, COMMANDS, RETURNCODES, Peer, deserialise, user_name
+
+def source_fd(frame: zmq.Frame) -> int:
+    ''' File descriptor of the connection a message arrived on, or -1. '''
+    try:
+        return frame.get(zmq.SRCFD)
+    except zmq.ZMQError:
+        return -1
+
+def peer_credentials(fd: int) -> Peer:
+    ''' Looks up the peer of a connection (SO_PEERCRED). '''
+    try:
+        with socket.socket(fileno=os.dup(fd)) as s:
+            ucred = s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    except OSError:
+        return Peer()
+    pid, uid, gid = struct.unpack("3i", ucred)
+    return Peer(uid=uid, pid=pid)
+
+def remote_peer(frame: zmq.Frame) -> Peer:
+    ''' The peer of a CURVE authenticated TCP connection.
+
+    Only clients with an authorised key get through, and they act as
+    root: they may end the sessions of any user.
+    '''
+    return Peer(uid=0, key=frame.get("User-Id"))
+
+def unique_url(transport: str = "inproc") -> str:
+    ''' An endpoint of its own for a server, for running many servers (tests) side by side.
+
+    transport is inproc, for a server and clients in one process that
+    share a Context, or ipc, for a socket in the temporary directory.
+    '''
+    name = f"gpvpn-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    if transport == "inproc":
+        return f"inproc://{name}"
+    if transport == "ipc":
+        return f"ipc://{os.path.join(tempfile.gettempdir(), name)}"
+    raise ValueError(f"No unique endpoints for transport {transport}.")
+
+def load_curve_keys(certificate: str) -> tuple[bytes, bytes | None]:
+    ''' Public and secret key of a certificate written by zmq.auth.create_certificates. '''
+    return zmq.auth.load_certificate(certificate)
+
+
+class RateLimiter:
+    ''' Token bucket per user: rate requests per second, with bursts up to burst. '''
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.buckets : dict[int, tuple[float, float]] = {} # uid -> (tokens, time)
+
+    def allow(self, uid: int) -> bool:
+        now = time.monotonic()
+        tokens, last = self.buckets.get(uid, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[uid] = (tokens, now)
+        return allowed
+
+
+@dataclasses.dataclass(order=True)
+class Request:
+    priority: int
+    sequence: int
+    identity: bytes = dataclasses.field(compare=False)
+    message: str = dataclasses.field(compare=False)
+    peer: Peer = dataclasses.field(compare=False)
+    command_code: typing.Any = dataclasses.field(compare=False)
+    deadline: float | None = dataclasses.field(compare=False) # unix time
+    fd: int = dataclasses.field(compare=False) # connection the request arrived on
+    received: float = dataclasses.field(compare=False, default_factory=time.monotonic)
+    socket: zmq.asyncio.Socket | None = dataclasses.field(compare=False, default=None) # to reply on
+
+
+class RoundRobin:
+    def __init__(self) -> None:
+        # priority -> uid -> requests; users are in the order of their turn.
+        self.turns : dict[int, collections.OrderedDict[int, collections.deque[Request]]] = {}
+        self.counts : collections.Counter[int] = collections.Counter()
+
+    def __len__(self) -> int:
+        return self.counts.total()
+
+    def count(self, uid: int) -> int:
+        return self.counts[uid]
+
+    def put(self, request: Request) -> None:
+        users = self.turns.setdefault(request.priority, collections.OrderedDict())
+        users.setdefault(request.peer.uid, collections.deque()).append(request)
+        self.counts[request.peer.uid] += 1
+
+    def get(self) -> Request:
+        priority = min(self.turns)
+        users = self.turns[priority]
+        uid, requests = next(iter(users.items()))
+        request = requests.popleft()
+        if requests:
+            users.move_to_end(uid) # next user's turn
+        else:
+            del users[uid]
+            if not users:
+                del self.turns[priority]
+        self.counts[uid] -= 1
+        if not self.counts[uid]:
+            del self.counts[uid]
+        return request
+
+
+class FairQueue(asyncio.Queue):
+    ''' Queue of requests, by priority, taking turns between users within a priority.
+
+    A user with many requests queued does not hold up the requests of
+    other users: each gets one request processed in turn.
+    '''
+    def _init(self, maxsize: int) -> None:
+        self._queue = RoundRobin()
+
+    def _put(self, request: Request) -> None:
+        self._queue.put(request)
+
+    def _get(self) -> Request:
+        return self._queue.get()
+
+    def user_qsize(self, uid: int) -> int:
+        return self._queue.count(uid)
+
 
 class IPCServer:
+    DRAIN_TIMEOUT=10 # seconds to wait for requests in flight when shutting down.
+    QUEUE_SIZE=16 # requests waiting to be processed; more are rejected as Busy.
+    USER_QUEUE_SIZE=4 # requests of one user waiting to be processed; more are rejected as Busy.
+    RATE=5 # requests per second per user ...
+    BURST=10 # ... with bursts up to this many requests.
+    PRIORITY_COMMANDS = (COMMANDS.Open, COMMANDS.Close, COMMANDS.Quit) # change state; go before status polling
+    ZAP_DOMAIN = "gpvpn" # authentication domain of the TCP socket
 
     def __init__(self,
                  message_processor: MessageProcessorBase,
                  socket_path: str = '/tmp',
-                 socket_name: str = 'ipcserver') -> None:
+                 socket_name: str = 'ipcserver',
+                 handle_signals: bool = False,
+                 profile_directory: str | None = None,
+                 tcp_url: str | None = None,
+                 curve_directory: str | None = None,
+                 url: str | None = None,
+                 context: zmq.asyncio.Context | None = None) -> None:
+        ''' A server on an ipc socket in socket_path, and optionally on a TCP socket.
+
+        url (ipc:// or inproc://) replaces the socket in socket_path.
+        Servers on inproc:// share their context with their clients,
+        which are in the same process; a context passed in is not
+        terminated when the server closes. The TCP socket, bound to tcp_url, requires CURVE authentication.
+        curve_directory holds the certificate of the server
+        (server.key_secret) and the public keys of the clients allowed to
+        connect (authorized_keys/*.key).
+        '''
+        if tcp_url and not curve_directory:
+            raise ValueError("A TCP socket requires a curve_directory with the keys to authenticate clients.")
         self.message_processor = message_processor
         self.socket_path = socket_path
         self.socket_name = socket_name
+        self.url = url
+        self.shared_context = context
+        self.tcp_url = tcp_url
+        self.curve_directory = curve_directory
         self.context : zmq.asyncio.Context
         self.socket : zmq.asyncio.Socket
+        self.tcp_socket : zmq.asyncio.Socket | None = None
+        self.tcp_endpoint : str | None = None # tcp_url with the port filled in
+        self.authenticator : ThreadAuthenticator | None = None
         self.task : asyncio.Task
+        self.tcp_task : asyncio.Task | None = None
+        self.background_tasks : list[asyncio.Task] = []
+        self._path : str | None = None # of the ipc socket
+        self.socket_activated = False
+        self.handle_signals = handle_signals # shut down gracefully on SIGTERM/SIGINT, reload on SIGHUP, profile on SIGUSR1
+        self.profiler = Profiler(profile_directory) if profile_directory else None
+        self.stopping = asyncio.Event()
+        self.ready = asyncio.Event() # set once requests are accepted
+        self.busy = False
+        self.shutdown_report : dict = {}
+        self.queue : FairQueue = FairQueue(maxsize=self.QUEUE_SIZE)
+        self.sequence = itertools.count()
+        self.rate_limiter = RateLimiter(self.RATE, self.BURST)
+        self.worker : asyncio.Task
+        self.monitor : zmq.asyncio.Socket
+        self.inflight : tuple[Request, asyncio.Task] | None = None
+        self.disconnected : dict[int, float] = {} # fd -> time the client disconnected
+        self.statistics = dict(received=0,
+                               processed=0,
+                               rejected_queue_full=0,
+                               rejected_user_queue_full=0,
+                               rejected_rate_limit=0,
+                               deadline_exceeded=0,
+                               cancelled=0,
+                               max_queue_depth=0)
+        self.user_statistics : collections.defaultdict[int, collections.Counter] = collections.defaultdict(collections.Counter)
         logger.debug("Inited")
         
+    @property
+    def in_process(self) -> bool:
+        return self.url is not None and self.url.startswith("inproc://")
+
     def open(self) -> None:
-        self.context = zmq.asyncio.Context()
-        self.socket = self.context.socket(zmq.REP)
-        # Using IPC: specify the IPC path
-        self._path = os.path.join(os.path.abspath(self.socket_path),
-                                  self.socket_name)
-        URL = f'ipc://{self._path}'
+        self.context = zmq.asyncio.Context() if self.shared_context is None else self.shared_context
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.monitor = self.socket.get_monitor_socket(zmq.EVENT_DISCONNECTED)
+        if self.url is None:
+            # Using IPC: specify the IPC path
+            self._path = os.path.join(os.path.abspath(self.socket_path),
+                                      self.socket_name)
+            URL = f'ipc://{self._path}'
+        else:
+            URL = self.url
+            if URL.startswith("ipc://"):
+                self._path = URL[len("ipc://"):]
+        fds = systemd.listen_fds() if self.url is None else []
+        if fds:
+            # Socket activation: systemd has bound the socket and set its
+            # permissions already. The path has to match ListenStream=.
+            self.socket_activated = True
+            self.socket.setsockopt(zmq.USE_FD, fds[0])
+            logger.info(f"Using socket (fd {fds[0]}) passed in by systemd.")
         self.socket.bind(URL)
-        if os.getuid() == 0: # called as root
+        if os.getuid() == 0 and self._path is not None and not self.socket_activated: # called as root
             # set the permssion correctly rw for ug
             os.chmod(self._path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP)
             # Get the GID for the group 'gpvpn'
@@ -53,24 +270,181 @@ class IPCServer:
             # Set the group of the socket file
             os.chown(self._path, -1, gid)  # -1 to keep the current owner
         logger.info(f"gpvpn server serving at {URL}.")
+        if self.tcp_url:
+            self.open_tcp()
+
+    def open_tcp(self) -> None:
+        ''' Binds the CURVE authenticated TCP socket. '''
+        public, secret = load_curve_keys(os.path.join(self.curve_directory, "server.key_secret"))
+        # the authenticator runs in a thread of its own, as the event loop may not run yet.
+        self.authenticator = ThreadAuthenticator(self.context)
+        self.authenticator.start()
+        self.authenticator.configure_curve(domain=self.ZAP_DOMAIN, location=os.path.join(self.curve_directory, "authorized_keys"))
+        self.tcp_socket = self.context.socket(zmq.ROUTER)
+        self.tcp_socket.curve_publickey = public
+        self.tcp_socket.curve_secretkey = secret
+        self.tcp_socket.curve_server = True
+        # refuse clients, rather than let them in, if the authenticator is not there.
+        self.tcp_socket.zap_domain = self.ZAP_DOMAIN.encode()
+        self.tcp_socket.zap_enforce_domain = True
+        self.tcp_socket.bind(self.tcp_url)
+        self.tcp_endpoint = self.tcp_socket.last_endpoint.decode()
+        logger.info(f"gpvpn server serving at {self.tcp_endpoint} (CURVE).")
         
     def close(self) -> None:
+        self.socket.disable_monitor()
+        self.monitor.close()
         self.socket.close()
-        self.context.term()
-        os.unlink(self._path)
+        if self.tcp_socket is not None:
+            self.tcp_socket.close(linger=0)
+            self.authenticator.stop()
+        if self.shared_context is None:
+            self.context.term()
+        if self._path is not None and not self.socket_activated: # otherwise the socket file is owned by systemd.
+            os.unlink(self._path)
         logger.info("gpvpn server shut down.")
         
-    async def listen(self) -> None:
+    def parse_request(self, message: str) -> tuple[typing.Any, float | None]:
+        ''' Command code and deadline of a request, as far as they can be told. '''
+        try:
+            d = deserialise(message)
+            return d["command_code"], d.get("deadline")
+        except (ValueError, KeyError, TypeError):
+            return None, None
+
+    def get_statistics(self) -> dict:
+        users = {user_name(uid): dict(received=counts["received"],
+                                      processed=counts["processed"],
+                                      rejected=counts["rejected"],
+                                      queued=self.queue.user_qsize(uid))
+                 for uid, counts in self.user_statistics.items()}
+        return dict(self.statistics, queue_depth=self.queue.qsize(), users=users)
+
+    async def reject(self, identity: bytes, peer: Peer, reason: str, socket: zmq.asyncio.Socket | None = None) -> None:
+        ''' Replies Busy to a request that is not processed. '''
+        self.statistics[reason] += 1
+        self.user_statistics[peer.uid]["rejected"] += 1
+        await self.reply(identity, json.dumps(dict(return_code=RETURNCODES.Busy)), socket)
+
+    def start_profiling(self, peer: Peer | None = None, duration: typing.Any = None) -> dict:
+        ''' Starts a profiling session, if allowed. Returns the reply to the Profile command.
+
+        Only root and the user running the server may profile it (peer is
+        None for SIGUSR1).
+        '''
+        if self.profiler is None:
+            logger.warning("Profiling requested, but no profile directory is configured.")
+            return dict(return_code=RETURNCODES.Failed)
+        if peer is not None and peer.uid not in (0, os.getuid()):
+            logger.warning(f"Profiling requested by {peer}, who is not allowed to.")
+            return dict(return_code=RETURNCODES.NotPermitted)
+        try:
+            duration = None if duration is None else float(duration)
+        except (TypeError, ValueError):
+            duration = None
+        files = self.profiler.start(duration)
+        if files is None:
+            return dict(return_code=RETURNCODES.Busy)
+        return dict(return_code=RETURNCODES.Success, **files)
+
+    async def reply(self, identity: bytes, message: str, socket: zmq.asyncio.Socket | None = None) -> None:
+        socket = self.socket if socket is None else socket
+        await socket.send_multipart([identity, b"", message.encode()])
+
+    async def listen(self, socket: zmq.asyncio.Socket | None = None) -> None:
+        ''' Accepts requests on socket (default: the ipc socket) and queues them for the worker.
+
+        Requests are rejected with a Busy return code, rather than queued,
+        when the user sending them exceeds the rate limit or has
+        USER_QUEUE_SIZE requests queued already, or when the queue is
+        full. Requests for statistics are answered immediately, without
+        queueing, as are requests for profiling, which runs in the
+        background; both count towards the rate limit.
+        '''
+        socket = self.socket if socket is None else socket
+        remote = socket is self.tcp_socket
         logger.debug("Starting to listen...")
         while True:
             logger.debug("Waiting for message to arrive")
-            recvd_message = await self.socket.recv_string()
-            logger.info(f"Received request: {recvd_message}")
-            return_message = await self.message_processor.process(recvd_message)
-            logger.debug(f"Returned message: {return_message}")
-            # Send a reply back to the client
-            await self.socket.send_string(return_message)
-            # Check if we got a request to shut down (-> break the loop)
+            frames = await socket.recv_multipart(copy=False)
+            if len(frames) != 3:
+                logger.warning(f"Ignoring message with {len(frames)} frames.")
+                continue
+            identity, _, frame = frames
+            fd = source_fd(frame)
+            if remote:
+                peer = remote_peer(frame)
+            elif self.in_process:
+                peer = Peer(uid=os.getuid(), pid=os.getpid())
+            else:
+                peer = peer_credentials(fd)
+            recvd_message = frame.bytes.decode()
+            self.statistics["received"] += 1
+            self.user_statistics[peer.uid]["received"] += 1
+            logger.info(f"Received request from {peer}: {recvd_message}")
+            command_code, deadline = self.parse_request(recvd_message)
+            if not self.rate_limiter.allow(peer.uid):
+                logger.warning(f"Rate limit exceeded by {peer}. Rejecting request.")
+                await self.reject(identity.bytes, peer, "rejected_rate_limit", socket)
+                continue
+            if command_code == COMMANDS.Statistics:
+                await self.reply(identity.bytes, json.dumps(dict(return_code=RETURNCODES.Success,
+                                                                 **self.get_statistics())), socket)
+                continue
+            if command_code == COMMANDS.Profile:
+                duration = deserialise(recvd_message).get("duration")
+                await self.reply(identity.bytes, json.dumps(self.start_profiling(peer, duration)), socket)
+                continue
+            priority = 0 if command_code in self.PRIORITY_COMMANDS else 1
+            request = Request(priority, next(self.sequence),
+                              identity.bytes, recvd_message, peer,
+                              command_code, deadline, fd, socket=socket)
+            if self.queue.user_qsize(peer.uid) >= self.USER_QUEUE_SIZE:
+                logger.warning(f"Too many requests of {peer} queued. Rejecting request.")
+                await self.reject(identity.bytes, peer, "rejected_user_queue_full", socket)
+                continue
+            try:
+                self.queue.put_nowait(request)
+            except asyncio.QueueFull:
+                logger.warning(f"Request queue is full. Rejecting request from {peer}.")
+                await self.reject(identity.bytes, peer, "rejected_queue_full", socket)
+                continue
+            self.statistics["max_queue_depth"] = max(self.statistics["max_queue_depth"], self.queue.qsize())
+
+    def abandoned(self, request: Request) -> bool:
+        ''' Whether the client disconnected after sending the request. '''
+        return self.disconnected.get(request.fd, float("-inf")) > request.received
+
+    async def watch_disconnects(self) -> None:
+        ''' Cancels work that does not change state when its client disconnects. '''
+        while True:
+            event = parse_monitor_message(await self.monitor.recv_multipart())
+            fd = int(event["value"])
+            self.disconnected[fd] = time.monotonic()
+            if self.inflight is None:
+                continue
+            request, task = self.inflight
+            if request.fd == fd and request.command_code not in self.PRIORITY_COMMANDS:
+                logger.info(f"Client of {request.peer} disconnected. Cancelling its request.")
+                task.cancel()
+
+    async def work(self) -> None:
+        ''' Processes the queued requests, one at a time. '''
+        while True:
+            request = await self.queue.get()
+            self.busy = True # from here on, the request is in flight.
+            try:
+                return_message = await self.process(request)
+                if return_message is None:
+                    continue
+                logger.debug(f"Returned message: {return_message}")
+                # Send a reply back to the client
+                await self.reply(request.identity, return_message, request.socket)
+            finally:
+                self.inflight = None
+                self.busy = False
+                self.queue.task_done()
+            # Check if we got a request to shut down
             return_message_dict = deserialise(return_message)
             try:
                 quit_application = return_message_dict['return_code'] == RETURNCODES.QuitApplication
@@ -78,17 +452,109 @@ class IPCServer:
                 logger.warning(f"Sending back a return message which is not of type return_code.\n{return_message_dict}.")
             else:
                 if quit_application:
-                    break
-                
-            
+                    self.request_shutdown()
+
+    async def process(self, request: Request) -> str | None:
+        ''' Processes a request. Returns None if nobody waits for the reply anymore. '''
+        if self.abandoned(request) and request.command_code not in self.PRIORITY_COMMANDS:
+            logger.info(f"Client of {request.peer} disconnected. Dropping its request.")
+            self.statistics["cancelled"] += 1
+            return None
+        if request.deadline is not None and time.time() > request.deadline:
+            logger.warning(f"Deadline of request from {request.peer} passed while queued.")
+            self.statistics["deadline_exceeded"] += 1
+            return json.dumps(dict(return_code=RETURNCODES.DeadlineExceeded))
+        task = asyncio.create_task(self.message_processor.process(request.message, request.peer))
+        self.inflight = (request, task)
+        try:
+            return_message = await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise # the worker itself is cancelled
+            self.statistics["cancelled"] += 1
+            return None
+        self.statistics["processed"] += 1
+        self.user_statistics[request.peer.uid]["processed"] += 1
+        return return_message
+
     async def run(self) -> None:
         logger.info("Listening for incomming connections...")
+        loop = asyncio.get_running_loop()
         self.task = asyncio.create_task(self.listen())
+        listeners = {self.task}
+        if self.tcp_socket is not None:
+            self.tcp_task = asyncio.create_task(self.listen(self.tcp_socket))
+            listeners.add(self.tcp_task)
+        self.worker = asyncio.create_task(self.work())
+        self.background_tasks = [asyncio.create_task(c) for c in self.message_processor.background_tasks()]
+        self.background_tasks.append(asyncio.create_task(self.watch_disconnects()))
+        watchdog_interval = systemd.watchdog_interval()
+        if watchdog_interval:
+            self.background_tasks.append(asyncio.create_task(systemd.watchdog_loop(watchdog_interval)))
+        if self.handle_signals:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, self.request_shutdown)
+            loop.add_signal_handler(signal.SIGHUP, self.message_processor.reload)
+            if self.profiler is not None:
+                loop.add_signal_handler(signal.SIGUSR1, self.start_profiling)
+        systemd.notify("READY=1")
+        self.ready.set()
+        stopping = asyncio.create_task(self.stopping.wait())
+        await asyncio.wait({*listeners, self.worker, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
         try:
-            await self.task            
-        except asyncio.CancelledError:
-            pass
+            await self.shutdown()
+        finally:
+            if self.handle_signals:
+                for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1):
+                    loop.remove_signal_handler(signum)
+        for task in (*listeners, self.worker):
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def request_shutdown(self) -> None:
+        if not self.stopping.is_set():
+            logger.info("Shutdown requested.")
+            self.stopping.set()
+
+    async def shutdown(self) -> dict:
+        ''' Stops accepting requests, drains the requests in flight and cleans up.
+
+        Queued requests and the request being processed are given
+        DRAIN_TIMEOUT seconds to complete. Returns (and logs) a report of
+        what was done.
+        '''
+        systemd.notify("STOPPING=1")
+        self.stopping.set()
+        listeners = [task for task in (self.task, self.tcp_task) if task is not None]
+        for task in listeners:
+            task.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        report = dict(drained=False, abandoned=False, abandoned_requests=0)
+        if not self.worker.done() and (self.busy or not self.queue.empty()):
+            logger.info(f"Waiting up to {self.DRAIN_TIMEOUT} s for {self.queue.qsize() + self.busy} request(s) in flight...")
+            try:
+                await asyncio.wait_for(self.queue.join(), self.DRAIN_TIMEOUT)
+            except TimeoutError:
+                report["abandoned"] = True
+                report["abandoned_requests"] = self.queue.qsize() + self.busy
+                logger.warning(f"Abandoning {report['abandoned_requests']} request(s) that did not complete in time.")
+            else:
+                report["drained"] = True
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        if self.profiler is not None:
+            await self.profiler.stop()
+        report.update(await self.message_processor.shutdown())
         self.close()
+        report["socket_removed"] = self._path is not None and not self.socket_activated
+        report["statistics"] = self.get_statistics()
+        logger.info(f"Shutdown report: {report}.")
+        self.shutdown_report = report
+        return report
 
     async def stop(self) -> None:
         if self.task.done():
@@ -97,8 +563,8 @@ class IPCServer:
             else:
                 logger.warning("Trying to stop listen task that is already finished.")
         else:
-            self.task.cancel()
             logger.debug("Stopping server...")
+            self.request_shutdown()
 
 
 
@@ -106,19 +572,27 @@ class IPCClient:
     def __init__(self,
                  cfg: GPVpnAuthConfig,
                  socket_path: str = '/tmp',
-                 socket_name: str = 'ipcserver') -> None:
+                 socket_name: str = 'ipcserver',
+                 url: str | None = None,
+                 curve_keys: tuple[bytes, bytes, bytes] | None = None,
+                 context: zmq.asyncio.Context | None = None) -> None:
+        ''' A client of the server on the ipc socket in socket_path, or at url.
+
+        curve_keys (public and secret key of the client, public key of
+        the server) authenticate the client to a server on TCP. Clients
+        of a server on inproc:// use the context of the server.
+        '''
         self.socket_path = socket_path
         self.socket_name = socket_name
-        self.context = zmq.asyncio.Context()
+        self.url = url
+        self.shared_context = context
+        self.context = zmq.asyncio.Context() if context is None else context
         self.socket = self.context.socket(zmq.REQ)
+        if curve_keys is not None:
+            self.socket.curve_publickey, self.socket.curve_secretkey, self.socket.curve_serverkey = curve_keys
         self.groupname = GROUPNAME
-        self.auth_command = self._construct_auth_command(cfg)
-        
-    def _construct_auth_command(self, cfg: GPVpnAuthConfig) -> [str]:
-        auth_command = [cfg.vpnauth_path]
-        auth_command += [i.strip() for i in cfg.vpnauth_options.split()]
-        auth_command += [cfg.vpnauth_url]
-        return auth_command
+        self.auth_command = cfg.auth_command()
+        self.request_timeout = cfg.request_timeout
         
     def __enter__(self) -> typing.Self:
         self.verify_in_group()
@@ -147,14 +621,17 @@ class IPCClient:
         return return_value
             
     def open(self):
-        path = os.path.join(os.path.abspath(self.socket_path),
-                            self.socket_name)
-        URL = f'ipc://{path}'
-        self.socket.connect(URL)
+        if self.url is None:
+            path = os.path.join(os.path.abspath(self.socket_path),
+                                self.socket_name)
+            self.url = f'ipc://{path}'
+        self.socket.connect(self.url)
         
     def close(self) -> None:
-        self.socket.close()
-        self.context.term()
+        # do not hang on to a request a server that cannot be reached never took.
+        self.socket.close(linger=0)
+        if self.shared_context is None:
+            self.context.term()
         logger.debug("Client Closed")
 
     async def authenticate(self):
@@ -167,18 +644,32 @@ class IPCClient:
         logger.debug("Authentication completed.")
         return stdout
 
-    async def send_request(self, message: str) -> str:
-        d = dict(command_code=message)
+    async def send_request(self, message: str, timeout: float | None = None, **fields: typing.Any) -> str:
+        ''' Sends a request and waits for the reply.
+
+        The server is told to give up on the request after timeout
+        seconds (default: request_timeout from the configuration), after
+        which the client stops waiting as well. fields are passed on to
+        the server in the request, such as the duration of a profiling
+        session.
+        '''
+        d = dict(command_code=message, **fields)
         if message == COMMANDS.Open:
             bmessage = await self.authenticate()
             logincode = bmessage.decode()
             d["logincode"] = logincode
+        timeout = self.request_timeout if timeout is None else timeout
+        d["deadline"] = time.time() + timeout
         logger.debug(f"Dictionary to pass on: {d}")
         json_message = json.dumps(d)
         await self.socket.send_string(json_message)
         logger.debug("Waiting for reply from server...")
         # Wait for a reply
-        reply = await self.socket.recv()
+        try:
+            reply = await asyncio.wait_for(self.socket.recv(), timeout)
+        except TimeoutError:
+            logger.error(f"No reply from server within {timeout} s.")
+            return dict(return_code=RETURNCODES.DeadlineExceeded)
         logger.debug(f"Reply from server: {reply}.")
         return deserialise(reply.decode())
 
@@ -0,0 +1,112 @@
+import grp
+import logging
+import mmap
+import os
+import stat
+import struct
+import time
+
+from gpvpn.common import GROUPNAME, RETURNCODES
+
+logger = logging.getLogger(__name__)
+
+# Fixed layout of the status page. The sequence counter implements a
+# seqlock: the writer makes it odd before touching the payload and even
+# again afterwards, so a reader that sees the same even value before
+# and after copying the payload has a consistent view.
+#
+#   magic(4s) layout(I) sequence(Q) state(i) pid(i) since(d) updated(d) gateway(64s)
+MAGIC = b"GPVS"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+PAYLOAD = struct.Struct("<iidd64s")
+PAGE_SIZE = HEADER.size + PAYLOAD.size
+SEQUENCE_OFFSET = 8
+
+MAX_AGE = 15 # seconds after which a page is considered stale
+READ_ATTEMPTS = 100
+
+
+class StatusPageWriter:
+    ''' Publishes the server state to a small memory-mapped file.
+
+    The file is created with mode 0640 and, when running as root, is
+    owned by the gpvpn group, so that members of the group can read the
+    state without talking to the server.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.sequence = 0
+        self.mmap: mmap.mmap | None = None
+
+    def open(self) -> None:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP)
+        try:
+            os.ftruncate(fd, PAGE_SIZE)
+            self.mmap = mmap.mmap(fd, PAGE_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        os.chmod(self.path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP)
+        if os.getuid() == 0:
+            try:
+                gid = grp.getgrnam(GROUPNAME).gr_gid
+            except KeyError:
+                logger.warning(f"Groupname {GROUPNAME} is not available. Status page {self.path} is readable by root only.")
+            else:
+                os.chown(self.path, -1, gid)
+        HEADER.pack_into(self.mmap, 0, MAGIC, LAYOUT_VERSION, self.sequence)
+        logger.info(f"Publishing status page at {self.path}.")
+
+    def close(self, unlink: bool = True) -> None:
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def publish(self, state: RETURNCODES, pid: int, since: float, gateway: str) -> None:
+        if self.mmap is None:
+            return
+        self.sequence += 1 # odd: write in progress
+        struct.pack_into("<Q", self.mmap, SEQUENCE_OFFSET, self.sequence)
+        PAYLOAD.pack_into(self.mmap, HEADER.size, int(state), pid, since, time.time(),
+                          gateway.encode()[:64])
+        self.sequence += 1 # even: page consistent
+        struct.pack_into("<Q", self.mmap, SEQUENCE_OFFSET, self.sequence)
+
+
+def read_status_page(path: str, max_age: float = MAX_AGE) -> dict | None:
+    ''' Reads the status page without any IPC round-trip.
+
+    Returns None when the page is missing, has an unknown layout, could
+    not be read consistently or has not been updated for max_age seconds.
+    '''
+    try:
+        with open(path, 'rb') as fp:
+            page = mmap.mmap(fp.fileno(), PAGE_SIZE, mmap.MAP_SHARED, mmap.PROT_READ)
+    except (OSError, ValueError):
+        return None
+    with page:
+        magic, layout, _ = HEADER.unpack_from(page, 0)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            return None
+        for _ in range(READ_ATTEMPTS):
+            sequence_before, = struct.unpack_from("<Q", page, SEQUENCE_OFFSET)
+            if sequence_before & 1:
+                continue
+            state, pid, since, updated, gateway = PAYLOAD.unpack_from(page, HEADER.size)
+            sequence_after, = struct.unpack_from("<Q", page, SEQUENCE_OFFSET)
+            if sequence_before == sequence_after:
+                break
+        else:
+            return None
+    if sequence_before == 0 or time.time() - updated > max_age:
+        return None
+    return dict(return_code=state,
+                pid=pid,
+                since=since,
+                updated=updated,
+                gateway=gateway.rstrip(b"\0").decode())
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+# Minimal implementation of the systemd socket activation and
+# notification protocols, see sd_listen_fds(3) and sd_notify(3).
+
+SD_LISTEN_FDS_START = 3
+
+
+def listen_fds(unset_environment: bool = True) -> list[int]:
+    ''' File descriptors passed in by socket activation.
+
+    Returns an empty list when the process was not socket activated, or
+    when the file descriptors were meant for another process.
+    '''
+    try:
+        pid = int(os.environ.get("LISTEN_PID", ""))
+        n_fds = int(os.environ.get("LISTEN_FDS", ""))
+    except ValueError:
+        fds = []
+    else:
+        if pid == os.getpid():
+            fds = list(range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + n_fds))
+        else:
+            fds = []
+    if unset_environment:
+        # do not pass these on to our own subprocesses.
+        for variable in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+            os.environ.pop(variable, None)
+    for fd in fds:
+        os.set_inheritable(fd, False)
+    return fds
+
+
+def notify(state: str) -> bool:
+    ''' Sends a state string, such as "READY=1", to the service manager.
+
+    Returns False when not running under a service manager that expects
+    notifications, or when the message could not be sent.
+    '''
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"): # abstract namespace socket
+        address = "\0" + address[1:]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as s:
+        try:
+            s.sendto(state.encode(), address)
+        except OSError as e:
+            logger.warning(f"Could not notify service manager ({e}).")
+            return False
+    logger.debug(f"Notified service manager: {state!r}.")
+    return True
+
+
+def watchdog_interval() -> float | None:
+    ''' Watchdog timeout (seconds) requested by the service manager, if any. '''
+    try:
+        usec = int(os.environ.get("WATCHDOG_USEC", ""))
+    except ValueError:
+        return None
+    pid = os.environ.get("WATCHDOG_PID")
+    if pid and pid != str(os.getpid()):
+        return None
+    return usec / 1e6 if usec > 0 else None
+
+
+async def watchdog_loop(interval: float) -> None:
+    ''' Keeps the watchdog happy, pinging at half the timeout. '''
+    while True:
+        notify("WATCHDOG=1")
+        await asyncio.sleep(interval / 2)
@@ -1,5 +1,6 @@
 import pytest
 import asyncio
+import contextlib
 
 from typing import Awaitable
 
@@ -20,21 +21,42 @@ async def run_awaitable_with_delay(task: Awaitable, delay: float) -> None:
     print(f"task {task.__name__} is completed.")
     return return_value
 
-
+@contextlib.asynccontextmanager
+async def serving(server):
+    ''' Runs server for the duration of the with block. Starts as soon as the server is ready, without sleeping. '''
+    task = asyncio.create_task(server.run())
+    ready = asyncio.create_task(server.ready.wait())
+    await asyncio.wait({task, ready}, return_when=asyncio.FIRST_COMPLETED)
+    if task.done():
+        ready.cancel()
+        task.result() # raises what stopped the server
+    try:
+        yield server
+    finally:
+        await server.stop()
+        await task
+
+
+@pytest.fixture
+def logincode():
+    # output of the gpauthMockUp exe.
+    s = '{"success":{"portalUserauthcookie":"","preloginCookie":"HyiL+E5lbwtah/vkSYDaJ0AZfAk+GLJIEjmjrXvnfNn3v1eDS+cgDY7NbjvwZjb28WQQeQ==","token":null,"username":"lucas.merckelbach@hereon.de"}}'
+    return s
 
 class IPCClientMockUp(IPCClient):
     def __init__(self):
         super().__init__()
         # Override auth command with a mocked up version
-        self.auth_command = ["gpauthMockup/gpauthMockUp",
+        self.auth_command = ("gpauthMockup/gpauthMockUp",
                              "--fix-openssl",
                              "--default-browser",
                              "--gateway",
-                             "gpp.hereon.de"]
+                             "gpp.hereon.de")
 
 class MessageProcessorVPNControllerWithTimeout(MessageProcessorVPNController):
-    def __init__(self, timeout=1):
+    def __init__(self, timeout=1, status_page=None, gpclient_options=()):
+        # gpclient_options: fault injection options of gpclientMockUp, such as "--crash-after=0.5"
         cfg = GPVpnConfig(["tests/mockup.ini"])
-        cfg.vpnclient_options=" ".join([f"--timeout={timeout}", *cfg.vpnclient_options])
-        super().__init__(cfg)
+        cfg.vpnclient_options=" ".join([f"--timeout={timeout}", *gpclient_options, *cfg.vpnclient_options])
+        super().__init__(cfg, status_page=status_page)
         self.WAIT_FOR_LOCKFILE=0.5
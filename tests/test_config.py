@@ -1,6 +1,8 @@
 import pytest
 import os
+import sys
 import tempfile
+import dataclasses
 from dataclasses import asdict
 
 from gpvpn import config
@@ -42,12 +44,84 @@ def test_set_config_values(config_filename):
     mp = MessageProcessorVPNController(cfg)
     assert mp.lockfile == "lock_directory/lock_filename"
     assert mp.logfile == "log_directory/log_filename"
-    assert mp.vpn_command == ['/usr/bin/gpclient', '--fix-openssl', 'connect', '--browser default', 'vpn.hereon.de']
+    assert mp.vpn_command == ('/usr/bin/gpclient', '--fix-openssl', 'connect', '--browser', 'default', 'vpn.hereon.de')
 
 def test_set_config_default_values():
     cfg = config.GPVpnConfig(["/tmp/not_EXISTING"])
     mp = MessageProcessorVPNController(cfg)
     assert mp.lockfile == "/var/run/gpclient.lock"
     assert mp.logfile == "/var/log/gpclient.log"
-    assert mp.vpn_command == ['/usr/bin/gpclient', '--fix-openssl', 'connect', '--browser default', 'vpn.hereon.de']
+    assert mp.vpn_command == ('/usr/bin/gpclient', '--fix-openssl', 'connect', '--browser', 'default', 'vpn.hereon.de')
     
+
+def test_settings_snapshot_is_immutable(config_filename):
+    settings = config.GPVpnConfig([config_filename]).snapshot()
+    assert settings.lockfile == "lock_directory/lock_filename"
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.gateway = "elsewhere"
+
+def test_validate_settings(tmp_path, config_filename):
+    settings = config.GPVpnConfig([config_filename]).snapshot()
+    with pytest.raises(config.ConfigError, match="lock_directory"):
+        settings.validate()
+    settings = dataclasses.replace(settings,
+                                   lockfile=str(tmp_path / "gpclient.lock"),
+                                   logfile=str(tmp_path / "gpclient.log"),
+                                   vpn_command=(sys.executable,))
+    assert settings.validate() is settings
+    with pytest.raises(config.ConfigError, match="vpnclient_url"):
+        dataclasses.replace(settings, gateway="").validate()
+
+@pytest.fixture
+def watched_config(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(f"lock_directory = {tmp_path}\nlog_directory = {tmp_path}\n"
+                    f"vpnclient_path = {sys.executable}\nvpnclient_url = gw1\n")
+    watcher = config.ConfigWatcher([path])
+    cfg = watcher.load()
+    return path, watcher, cfg
+
+def test_config_watcher_skips_unchanged_files(watched_config):
+    path, watcher, cfg = watched_config
+    assert cfg.vpnclient_url == "gw1"
+    assert watcher.poll() is None
+
+def test_config_watcher_reloads_changed_files(watched_config):
+    path, watcher, cfg = watched_config
+    path.write_text(path.read_text().replace("gw1", "gw2"))
+    os.utime(path, ns=(1, 1)) # a different mtime, whatever the file system resolution
+    settings = watcher.poll()
+    assert settings.gateway == "gw2"
+    assert watcher.poll() is None
+
+def test_config_watcher_ignores_invalid_configuration(watched_config):
+    path, watcher, cfg = watched_config
+    path.write_text("lock_directory = /does/not/exist\n")
+    os.utime(path, ns=(1, 1))
+    assert watcher.poll() is None
+    # not retried until the file changes again.
+    assert not watcher.changed()
+
+def test_vpn_command_is_split_like_a_shell(tmp_path):
+    cfg = config.GPVpnConfig(["/tmp/not_EXISTING"])
+    cfg.vpnclient_options = '--fix-openssl --user-agent "PAN GlobalProtect"'
+    assert cfg.snapshot().vpn_command[:4] == ('/usr/bin/gpclient', '--fix-openssl', '--user-agent', 'PAN GlobalProtect')
+    cfg.vpnclient_options = '--user-agent "unbalanced'
+    with pytest.raises(config.ConfigError, match="vpnclient_options"):
+        cfg.snapshot()
+
+def test_check_executable(tmp_path):
+    assert config.check_executable("vpnclient_path", sys.executable) is None
+    assert config.check_executable("vpnclient_path", "sh") is None # found on the PATH
+    assert "does not exist" in config.check_executable("vpnclient_path", str(tmp_path / "gpclient"))
+    (tmp_path / "gpclient").write_text("")
+    assert "not executable" in config.check_executable("vpnclient_path", str(tmp_path / "gpclient"))
+
+def test_validate_auth_config():
+    cfg = config.GPVpnAuthConfig(["/tmp/not_EXISTING"])
+    assert cfg.auth_command() == ("/usr/bin/gpauth", "--fix-openssl", "--default-browser", "--gateway", "gpp.hereon.de")
+    cfg.vpnauth_path = str(os.path.abspath("gpauthMockup/gpauthMockUp"))
+    assert cfg.validate() is cfg
+    cfg.vpnauth_path = "/does/not/exist/gpauth"
+    with pytest.raises(config.ConfigError, match="vpnauth_path"):
+        cfg.validate()
@@ -0,0 +1,103 @@
+import pytest
+import asyncio
+import json
+import os
+import shutil
+
+import zmq.auth
+
+from gpvpn.fleet import Fleet, endpoint, format_table, host_name, read_hosts, summary
+from gpvpn.server import IPCServer
+from gpvpn.common import *
+from gpvpn.config import GPVpnAuthConfig
+
+# import some common functions, classes and fixtures:
+from conftest import *
+
+@pytest.fixture
+def curve(tmp_path):
+    ''' Keys of a server and of a fleet client that is allowed to connect to it. '''
+    server = tmp_path / "server"
+    client = tmp_path / "client"
+    for directory in (server / "authorized_keys", client / "servers"):
+        directory.mkdir(parents=True)
+    zmq.auth.create_certificates(server, "server")
+    zmq.auth.create_certificates(client, "client")
+    shutil.copy(client / "client.key", server / "authorized_keys")
+    shutil.copy(server / "server.key", client / "servers")
+    return server, client
+
+def servers_on_loopback(tmp_path, server_directory, n):
+    servers = []
+    for i in range(n):
+        server = IPCServer(message_processor=MessageProcessorVPNControllerWithTimeout(),
+                           socket_path=str(tmp_path), socket_name=f"ipcserver{i}",
+                           tcp_url="tcp://127.0.0.1:*", curve_directory=str(server_directory))
+        server.open()
+        servers.append(server)
+    return servers
+
+async def run_fleet(servers, fleet, command):
+    tasks = [asyncio.create_task(server.run()) for server in servers]
+    await asyncio.sleep(0.1)
+    try:
+        return await fleet.run(command)
+    finally:
+        for server in servers:
+            await server.stop()
+        await asyncio.gather(*tasks)
+
+def fleet_config(client_directory):
+    cfg = GPVpnAuthConfig()
+    cfg.fleet_curve_directory = str(client_directory)
+    return cfg
+
+def test_endpoint():
+    assert endpoint("lab1", 5555) == "tcp://lab1:5555"
+    assert endpoint("lab1:6000", 5555) == "tcp://lab1:6000"
+    assert endpoint("tcp://127.0.0.1:6000", 5555) == "tcp://127.0.0.1:6000"
+    assert host_name("tcp://lab1.example.org:6000") == "lab1.example.org"
+
+def test_read_hosts(tmp_path):
+    path = tmp_path / "hosts"
+    path.write_text("# lab machines\nlab1\n\nlab2:6000 # spare\n")
+    assert read_hosts(path) == ["lab1", "lab2:6000"]
+
+def test_fleet_status(tmp_path, curve):
+    server_directory, client_directory = curve
+    servers = servers_on_loopback(tmp_path, server_directory, 3)
+    # nothing listens on the last one.
+    hosts = [server.tcp_endpoint for server in servers] + ["tcp://127.0.0.1:1"]
+    fleet = Fleet(fleet_config(client_directory), hosts, concurrency=2, timeout=0.5)
+    results = asyncio.run(run_fleet(servers, fleet, COMMANDS.Status))
+    assert [result["host"] for result in results] == hosts
+    assert [result["return_code"] for result in results] == ["Inactive"] * 3 + ["DeadlineExceeded"]
+    assert results[0]["gateway"] == "gpp.hereon.de"
+    assert summary(results) == dict(hosts=4, ok=3, return_codes=dict(Inactive=3, DeadlineExceeded=1))
+    table = format_table(results).splitlines()
+    assert table[0].split() == ["HOST", "RESULT", "GATEWAY", "SINCE", "OWNER", "MS"]
+    assert table[-1] == "3/4 hosts ok: Inactive 3, DeadlineExceeded 1"
+    json.dumps(results)
+
+def test_fleet_rejects_unknown_client(tmp_path, curve):
+    server_directory, client_directory = curve
+    # a client with keys of its own, not authorised by the server.
+    os.unlink(client_directory / "client.key_secret")
+    zmq.auth.create_certificates(client_directory, "client")
+    servers = servers_on_loopback(tmp_path, server_directory, 1)
+    fleet = Fleet(fleet_config(client_directory), [servers[0].tcp_endpoint], timeout=0.5)
+    results = asyncio.run(run_fleet(servers, fleet, COMMANDS.Status))
+    assert results[0]["return_code"] == "DeadlineExceeded"
+    assert servers[0].shutdown_report["statistics"]["received"] == 0
+
+def test_fleet_missing_server_key(tmp_path, curve):
+    server_directory, client_directory = curve
+    os.unlink(client_directory / "servers" / "server.key")
+    fleet = Fleet(fleet_config(client_directory), ["lab1"], timeout=0.5)
+    results = asyncio.run(fleet.run(COMMANDS.Status))
+    assert results[0]["return_code"] == "Failed"
+    assert "No public key of lab1" in results[0]["error"]
+
+def test_tcp_requires_keys():
+    with pytest.raises(ValueError):
+        IPCServer(message_processor=MessageProcessorVPNControllerWithTimeout(), tcp_url="tcp://127.0.0.1:*")
@@ -0,0 +1,144 @@
+import pytest
+import asyncio
+import json
+import os
+import time
+
+import psutil
+
+from gpvpn.hooks import HookRunner, Hooks, find_cycles, find_hooks
+from gpvpn.message_processors import MessageProcessorVPNController
+from gpvpn.common import *
+from gpvpn.config import GPVpnConfig
+
+# import some common functions, classes and fixtures:
+from conftest import *
+
+def write_hook(directory, name, script, after=None, executable=True):
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / name
+    header = f"# gpvpn-after: {after}\n" if after else ""
+    path.write_text(f"#!/bin/sh\n{header}{script}\n")
+    if executable:
+        path.chmod(0o755)
+    return path
+
+def run_hooks(directory, concurrency=4, timeout=5, env=None):
+    results = asyncio.run(HookRunner(concurrency, timeout).run(str(directory), env))
+    return {result.name: result for result in results}
+
+def test_find_hooks(tmp_path):
+    write_hook(tmp_path, "10-a", "true")
+    write_hook(tmp_path, "20-b", "true", after="10-a")
+    write_hook(tmp_path, "readme", "true", executable=False)
+    write_hook(tmp_path, "30-c~", "true")
+    assert find_hooks(str(tmp_path)) == {"10-a": [], "20-b": ["10-a"]}
+    assert find_hooks(str(tmp_path / "missing")) == {}
+
+def test_find_cycles():
+    hooks = dict(a=["b"], b=["c"], c=["a"], d=["a"], e=[], f=["f"])
+    assert find_cycles(hooks) == {"a", "b", "c", "f"}
+
+def test_hooks_run_concurrently(tmp_path):
+    for i in range(4):
+        write_hook(tmp_path, f"hook{i}", "sleep 0.5")
+    t0 = time.monotonic()
+    results = run_hooks(tmp_path, concurrency=4)
+    assert time.monotonic() - t0 < 1.5
+    assert [result.status for result in results.values()] == ["ok"] * 4
+
+def test_hooks_bounded(tmp_path):
+    for i in range(4):
+        write_hook(tmp_path, f"hook{i}", "sleep 0.3")
+    t0 = time.monotonic()
+    run_hooks(tmp_path, concurrency=2)
+    assert time.monotonic() - t0 >= 0.6
+
+def test_hook_output_and_environment(tmp_path):
+    write_hook(tmp_path, "greet", 'echo "hello $GPVPN_GATEWAY"; echo oops >&2; exit 3')
+    result = run_hooks(tmp_path, env=dict(GPVPN_GATEWAY="gpp.example.org"))["greet"]
+    assert result.status == "failed"
+    assert result.returncode == 3
+    assert result.output == "hello gpp.example.org\noops\n"
+
+def test_hook_timeout_kills_children(tmp_path):
+    pidfile = tmp_path / "child.pid"
+    write_hook(tmp_path / "hooks", "slow", f"sleep 30 & echo $! > {pidfile}; wait")
+    t0 = time.monotonic()
+    result = run_hooks(tmp_path / "hooks", timeout=0.3)["slow"]
+    assert time.monotonic() - t0 < 5
+    assert result.status == "timeout"
+    time.sleep(0.1)
+    pid = int(pidfile.read_text())
+    # killed; a zombie until init reaps it.
+    assert not psutil.pid_exists(pid) or psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+
+def test_hook_dependencies(tmp_path):
+    log = tmp_path / "log"
+    hooks = tmp_path / "hooks"
+    write_hook(hooks, "mount", f"echo mount >> {log}", after="kerberos dns")
+    write_hook(hooks, "kerberos", f"sleep 0.2; echo kerberos >> {log}")
+    write_hook(hooks, "dns", f"sleep 0.1; echo dns >> {log}")
+    write_hook(hooks, "broken", "exit 1")
+    write_hook(hooks, "after-broken", "true", after="broken")
+    write_hook(hooks, "after-missing", "true", after="nothing")
+    write_hook(hooks, "chicken", "true", after="egg")
+    write_hook(hooks, "egg", "true", after="chicken")
+    results = run_hooks(hooks)
+    assert log.read_text().split() == ["dns", "kerberos", "mount"]
+    assert results["mount"].status == "ok"
+    assert (results["after-broken"].status, results["after-broken"].reason) == ("skipped", "broken failed")
+    assert (results["after-missing"].status, results["after-missing"].reason) == ("skipped", "nothing is not a hook")
+    assert results["chicken"].reason == results["egg"].reason == "circular dependency"
+
+def test_cancel_hooks(tmp_path):
+    write_hook(tmp_path / "post-connect.d", "slow", "sleep 30")
+    async def start_and_cancel():
+        hooks = Hooks(str(tmp_path))
+        hooks.start("post-connect")
+        await asyncio.sleep(0.2)
+        running = hooks.report()["post-connect"]["results"][0]["status"]
+        await hooks.cancel()
+        return running, hooks.report()["post-connect"]
+    running, run = asyncio.run(start_and_cancel())
+    assert running == "running"
+    assert run["state"] == "cancelled"
+    assert run["results"][0]["status"] == "cancelled"
+
+def hooked_controller(directory):
+    cfg = GPVpnConfig(["tests/mockup.ini"])
+    cfg.vpnclient_options = "--timeout=20"
+    cfg.hooks_directory = str(directory)
+    mp = MessageProcessorVPNController(cfg, status_page=None)
+    mp.WAIT_FOR_LOCKFILE = 0.5
+    try:
+        os.unlink(mp.lockfile)
+    except FileNotFoundError:
+        pass
+    return mp
+
+def test_connect_does_not_wait_for_hooks(tmp_path, logincode):
+    marker = tmp_path / "disconnected"
+    write_hook(tmp_path / "post-connect.d", "mount", 'sleep 1; echo "mounted for $GPVPN_EVENT"')
+    write_hook(tmp_path / "pre-disconnect.d", "umount", f"touch {marker}")
+    async def connect_and_query():
+        mp = hooked_controller(tmp_path)
+        try:
+            t0 = time.monotonic()
+            connected = json.loads(await mp.process(json.dumps(dict(command_code=COMMANDS.Open, logincode=logincode))))
+            elapsed = time.monotonic() - t0
+            running = json.loads(await mp.process(json.dumps(dict(command_code=COMMANDS.Hooks))))
+            await mp.hooks.tasks["post-connect"]
+            done = json.loads(await mp.process(json.dumps(dict(command_code=COMMANDS.Hooks))))
+            disconnected = json.loads(await mp.process(json.dumps(dict(command_code=COMMANDS.Close))))
+            return connected, elapsed, running, done, disconnected, marker.exists()
+        finally:
+            await mp.shutdown()
+    connected, elapsed, running, done, disconnected, unmounted = asyncio.run(connect_and_query())
+    assert connected["return_code"] == RETURNCODES.Success
+    assert elapsed < 1
+    assert running["post-connect"]["state"] == "running"
+    assert done["post-connect"]["state"] == "done"
+    assert done["post-connect"]["results"][0]["output"] == "mounted for post-connect\n"
+    assert disconnected["return_code"] == RETURNCODES.Success
+    assert unmounted
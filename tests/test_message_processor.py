@@ -1,13 +1,16 @@
 import pytest
 import asyncio
+import dataclasses
 import signal
 from typing import Awaitable
 import os
 import json
 import psutil
+import time
 
 from gpvpn.message_processors import MessageProcessorVPNController
 from gpvpn.common import *
+from gpvpn import config
 from gpvpn.config import GPVpnConfig
 
 # import some common functions, classes and fixtures:
@@ -16,12 +19,6 @@ from conftest import *
 #    async def test_tasks(*tasks):
 #    async def run_awaitable_with_delay(task: Awaitable, delay: float) -> None:
 
-@pytest.fixture
-def logincode():
-    # output of gpauthMockUp exe.
-    s = '{"success":{"portalUserauthcookie":"","preloginCookie":"HyiL+E5lbwtah/vkSYDaJ0AZfAk+GLJIEjmjrXvnfNn3v1eDS+cgDY7NbjvwZjb28WQQeQ==","token":null,"username":"lucas.merckelbach@hereon.de"}}'
-    return s
-
 @pytest.mark.asyncio
 async def run(limit):
     print(f"Starting run for {limit} seconds")
@@ -133,6 +130,14 @@ def test_start_start_stop(message_processor20, logincode):
     result = [decode(i) for i in r if not i is None]
     assert result == [RETURNCODES.Success, RETURNCODES.AlreadyConnected, RETURNCODES.Success]
 
+def test_disconnect_releases_subprocess(message_processor20, logincode):
+    mp = message_processor20
+    p = [run_awaitable_with_delay(mp.process(encode(COMMANDS.Open, logincode)), delay=0),
+         run_awaitable_with_delay(mp.process(encode(COMMANDS.Close)), delay=0.5)]
+    r = asyncio.run(test_tasks(*p))
+    assert [decode(i) for i in r] == [RETURNCODES.Success, RETURNCODES.Success]
+    assert mp.subprocess is None
+
 def test_quit_server(message_processor):
     r = asyncio.run(message_processor.process(encode(COMMANDS.Quit)))
     result = decode(r)
@@ -184,3 +189,144 @@ def test_not_is_process_running():
     assert not mp.is_gpclient_running(pid)
     
     
+
+def test_shutdown_terminates_gpclient(message_processor20, logincode):
+    mp = message_processor20
+    p = [run_awaitable_with_delay(mp.process(encode(COMMANDS.Open, logincode)), delay=0.1),
+         run_awaitable_with_delay(mp.shutdown(), delay=1)]
+    r = asyncio.run(test_tasks(*p))
+    assert decode(r[0]) == RETURNCODES.Success
+    assert "terminated_subprocess" in r[1]
+    assert mp.subprocess is None
+    assert not os.path.exists(mp.lockfile)
+
+def test_shutdown_removes_stale_lockfile(message_processor):
+    with open(message_processor.lockfile, 'w') as fp:
+        fp.write("-1\n")
+    report = asyncio.run(message_processor.shutdown())
+    assert report == dict(removed_stale_lockfile=True)
+    assert not os.path.exists(message_processor.lockfile)
+
+def test_connect_returns_when_lockfile_appears(message_processor, logincode):
+    message_processor.WAIT_FOR_LOCKFILE = 5
+    t0 = time.monotonic()
+    r = asyncio.run(message_processor.process(encode(COMMANDS.Open, logincode)))
+    assert decode(r) == RETURNCODES.Success
+    assert time.monotonic() - t0 < 1
+
+def test_connect_deadline_exceeded(message_processor20, logincode):
+    mp = message_processor20
+    m = json.dumps(dict(command_code=COMMANDS.Open, logincode=logincode, deadline=time.time() - 1))
+    r = asyncio.run(mp.process(m))
+    assert decode(r) == RETURNCODES.DeadlineExceeded
+    # the half-started gpclient has been cleaned up.
+    assert mp.subprocess is None
+    assert not os.path.exists(mp.lockfile)
+
+# Fault injection with gpclientMockUp
+async def connect_and_shutdown(mp, logincode):
+    r = await mp.process(encode(COMMANDS.Open, logincode))
+    await mp.shutdown()
+    return r
+
+def test_connect_cookie_rejected(logincode):
+    mp = MessageProcessorVPNControllerWithTimeout(gpclient_options=["--reject-cookie"])
+    mp.WAIT_FOR_LOCKFILE = 5
+    t0 = time.monotonic()
+    r = asyncio.run(mp.process(encode(COMMANDS.Open, logincode)))
+    assert decode(r) == RETURNCODES.Failed
+    # gpclient exited, no need to wait for the lockfile.
+    assert time.monotonic() - t0 < 1
+    assert not os.path.exists(mp.lockfile)
+
+def test_connect_slower_than_wait_for_lockfile(logincode):
+    mp = MessageProcessorVPNControllerWithTimeout(gpclient_options=["--startup-delay=2"])
+    r = asyncio.run(connect_and_shutdown(mp, logincode))
+    assert decode(r) == RETURNCODES.Failed
+
+def test_connect_lockfile_before_ready(logincode):
+    # the lockfile tells that gpclient runs, not that the tunnel is up.
+    mp = MessageProcessorVPNControllerWithTimeout(gpclient_options=["--startup-delay=2", "--lockfile-early"])
+    r = asyncio.run(connect_and_shutdown(mp, logincode))
+    assert decode(r) == RETURNCODES.Success
+
+def test_crashed_gpclient_leaves_stale_lockfile(logincode):
+    mp = MessageProcessorVPNControllerWithTimeout(timeout=20, gpclient_options=["--crash-after=0.3"])
+    p = [run_awaitable_with_delay(mp.process(encode(COMMANDS.Open, logincode)), delay=0),
+         run_awaitable_with_delay(mp.process(encode(COMMANDS.Status)), delay=1)]
+    r = asyncio.run(test_tasks(*p))
+    assert [decode(i) for i in r] == [RETURNCODES.Success, RETURNCODES.Inactive]
+    assert not os.path.exists(mp.lockfile)
+    assert mp.subprocess is None
+
+def test_shutdown_kills_gpclient_ignoring_sigterm(logincode):
+    mp = MessageProcessorVPNControllerWithTimeout(timeout=20, gpclient_options=["--ignore-sigterm"])
+    mp.TERMINATE_TIMEOUT = 0.2
+    p = [run_awaitable_with_delay(mp.process(encode(COMMANDS.Open, logincode)), delay=0),
+         run_awaitable_with_delay(mp.shutdown(), delay=0.5)]
+    r = asyncio.run(test_tasks(*p))
+    assert decode(r[0]) == RETURNCODES.Success
+    # killed, so the lockfile was left behind, and then removed as stale.
+    assert r[1]["removed_stale_lockfile"]
+    assert mp.subprocess is None
+
+def test_reload_keeps_settings_of_running_gpclient(message_processor20, logincode, tmp_path):
+    mp = message_processor20
+    old_lockfile = mp.lockfile
+    new_settings = dataclasses.replace(mp.settings,
+                                       lockfile=str(tmp_path / "gpclient.lock"),
+                                       gateway="gw.example.org")
+    async def connect_reload_disconnect():
+        r = [await mp.process(encode(COMMANDS.Open, logincode))]
+        mp.use_settings(new_settings)
+        # the running gpclient is still found through its own lockfile.
+        assert mp.lockfile == old_lockfile
+        r.append(await mp.process(encode(COMMANDS.Status)))
+        r.append(await mp.process(encode(COMMANDS.Close)))
+        return r
+    r = asyncio.run(connect_reload_disconnect())
+    assert [decode(i) for i in r] == [RETURNCODES.Success, RETURNCODES.Active, RETURNCODES.Success]
+    assert json.loads(r[1])["gateway"] == "gpp.hereon.de"
+    # future connects use the new settings.
+    assert mp.lockfile == new_settings.lockfile
+    assert mp.settings is new_settings
+
+def test_reload_from_watched_files(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(open("tests/mockup.ini").read())
+    watcher = config.ConfigWatcher([path])
+    mp = MessageProcessorVPNController(watcher.load(), status_page=None, config_watcher=watcher)
+    mp.reload() # unchanged
+    assert mp.settings.gateway == "gpp.hereon.de"
+    path.write_text(path.read_text().replace("gpp.hereon.de", "gw.example.org"))
+    os.utime(path, ns=(1, 1))
+    mp.reload()
+    assert mp.settings.gateway == "gw.example.org"
+
+# Session ownership
+OWNER = Peer(uid=1000, pid=1)
+OTHER = Peer(uid=1001, pid=2)
+
+def test_only_owner_disconnects(message_processor20, logincode):
+    mp = message_processor20
+    async def connect_and_disconnect():
+        r = [await mp.process(encode(COMMANDS.Open, logincode), OWNER)]
+        r.append(await mp.process(encode(COMMANDS.Status), OTHER))
+        r.append(await mp.process(encode(COMMANDS.Close), OTHER))
+        r.append(await mp.process(encode(COMMANDS.Quit), OTHER))
+        r.append(await mp.process(encode(COMMANDS.Close), OWNER))
+        return r
+    r = asyncio.run(connect_and_disconnect())
+    assert [decode(i) for i in r] == [RETURNCODES.Success, RETURNCODES.Active,
+                                      RETURNCODES.NotOwner, RETURNCODES.NotOwner, RETURNCODES.Success]
+    assert json.loads(r[1])["owner"] == user_name(OWNER.uid)
+    assert json.loads(r[1])["owned"] is False
+    assert mp.owner is None
+
+def test_root_disconnects_any_session(message_processor20, logincode):
+    mp = message_processor20
+    async def connect_and_disconnect():
+        return [await mp.process(encode(COMMANDS.Open, logincode), OWNER),
+                await mp.process(encode(COMMANDS.Close), Peer(uid=0))]
+    r = asyncio.run(connect_and_disconnect())
+    assert [decode(i) for i in r] == [RETURNCODES.Success, RETURNCODES.Success]
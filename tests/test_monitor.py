@@ -0,0 +1,149 @@
+import pytest
+import asyncio
+import json
+import os
+import socket
+
+from gpvpn.message_processors import MessageProcessorVPNController
+from gpvpn.monitor import RingBuffer, Sample, TunnelMonitor, tcp_probe, udp_probe, window_statistics
+from gpvpn.common import *
+from gpvpn.config import GPVpnConfig
+
+# import some common functions, classes and fixtures:
+from conftest import *
+
+class UDPEcho(asyncio.DatagramProtocol):
+    ''' Stand-in for an echo service inside the vpn. Drops datagrams while drop is set. '''
+    def __init__(self):
+        self.drop = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if not self.drop:
+            self.transport.sendto(data, address)
+
+async def udp_echo():
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(UDPEcho, local_addr=("127.0.0.1", 0))
+    return transport, protocol, transport.get_extra_info("sockname")[1]
+
+def unused_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_ring_buffer():
+    ring = RingBuffer(3)
+    assert ring.last() == []
+    for i in range(5):
+        ring.append(i)
+    assert len(ring) == 3
+    assert ring.last() == [2, 3, 4]
+    assert ring.last(2) == [3, 4]
+    ring.clear()
+    assert ring.last() == []
+
+def test_window_statistics():
+    samples = [Sample(1, 0.010), Sample(2, None), Sample(3, 0.030), Sample(4, 0.020)]
+    statistics = window_statistics(samples)
+    assert statistics["probes"] == 4
+    assert statistics["lost"] == 1
+    assert statistics["loss"] == 0.25
+    assert (statistics["rtt_min"], statistics["rtt_avg"], statistics["rtt_max"]) == (10, 20, 30)
+    assert statistics["jitter"] == 15 # (20 + 10) / 2
+    assert statistics["last"] == 4
+    assert window_statistics([])["loss"] is None
+
+def test_tcp_probe():
+    async def probe():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await tcp_probe("127.0.0.1", port, 1), await tcp_probe("127.0.0.1", unused_port(), 1)
+    answered, refused = asyncio.run(probe())
+    assert 0 < answered < 1
+    assert refused is None
+
+def test_udp_probe():
+    async def probe():
+        transport, echo, port = await udp_echo()
+        try:
+            answered = await udp_probe("127.0.0.1", port, 1)
+            echo.drop = True
+            return answered, await udp_probe("127.0.0.1", port, 0.1)
+        finally:
+            transport.close()
+    answered, lost = asyncio.run(probe())
+    assert 0 < answered < 1
+    assert lost is None
+
+def test_monitor_degradation_events():
+    monitor = TunnelMonitor(probe=None, window=4, max_loss=0.3, max_rtt=200)
+    events = []
+    monitor.listeners.append(events.append)
+    for t, rtt in enumerate([0.01, 0.01, 0.01, None, None, 0.01, 0.01, 0.01, 0.01]):
+        monitor.add(Sample(t, rtt))
+    assert [(event["event"], event["time"]) for event in events] == [("degraded", 4), ("recovered", 7)]
+    assert monitor.statistics()["events"] == events
+    monitor.add(Sample(9, 0.5)) # slow, but on average not too slow yet
+    assert not monitor.degraded
+    monitor.add(Sample(10, 0.5))
+    assert monitor.degraded
+
+def monitored_controller(port, protocol="udp", reconnect=False):
+    cfg = GPVpnConfig(["tests/mockup.ini"])
+    cfg.vpnclient_options = "--timeout=20"
+    cfg.monitor_target = f"127.0.0.1:{port}"
+    cfg.monitor_protocol = protocol
+    cfg.monitor_interval = 0.05
+    cfg.monitor_timeout = 0.05
+    cfg.monitor_window = 4
+    cfg.monitor_reconnect = reconnect
+    mp = MessageProcessorVPNController(cfg, status_page=None)
+    mp.WAIT_FOR_LOCKFILE = 0.5
+    try:
+        os.unlink(mp.lockfile)
+    except FileNotFoundError:
+        pass
+    return mp
+
+def test_status_reports_link_quality(logincode):
+    async def connect_and_probe():
+        transport, echo, port = await udp_echo()
+        mp = monitored_controller(port)
+        monitoring = asyncio.create_task(*mp.background_tasks())
+        try:
+            await mp.process(json.dumps(dict(command_code=COMMANDS.Open, logincode=logincode)))
+            await asyncio.sleep(0.3)
+            return json.loads(await mp.process(json.dumps(dict(command_code=COMMANDS.Status))))
+        finally:
+            monitoring.cancel()
+            await mp.shutdown()
+            transport.close()
+    status = asyncio.run(connect_and_probe())
+    assert status["return_code"] == RETURNCODES.Active
+    quality = status["quality"]
+    assert quality["target"].startswith("udp://127.0.0.1:")
+    assert quality["probes"] >= 3
+    assert quality["loss"] == 0
+    assert not quality["degraded"]
+
+def test_reconnect_when_degraded(logincode):
+    async def connect_and_degrade():
+        # nothing answers the probes.
+        mp = monitored_controller(unused_port(), protocol="tcp", reconnect=True)
+        monitoring = asyncio.create_task(*mp.background_tasks())
+        try:
+            await mp.process(json.dumps(dict(command_code=COMMANDS.Open, logincode=logincode)))
+            first = mp.subprocess.pid
+            await asyncio.sleep(0.5)
+            await mp.reconnect_task
+            return first, mp.subprocess.pid, mp.reconnects
+        finally:
+            monitoring.cancel()
+            await mp.shutdown()
+    first, second, reconnects = asyncio.run(connect_and_degrade())
+    assert first != second
+    assert reconnects >= 1
@@ -0,0 +1,93 @@
+import pytest
+import asyncio
+import os
+import signal
+import tracemalloc
+
+from gpvpn.profiling import Profiler, dump_task_stacks
+from gpvpn.server import IPCServer, IPCClient, Peer
+from gpvpn.message_processors import MessageProcessorReverse
+from gpvpn.common import *
+from gpvpn.config import GPVpnAuthConfig
+
+# import some common functions, classes and fixtures:
+from conftest import *
+
+def session_files(tmp_path):
+    return sorted(p.name.split("-", 2)[2] for p in tmp_path.iterdir())
+
+async def profile_session(profiler, duration):
+    files = profiler.start(duration)
+    second = profiler.start(duration) # one session at a time
+    await profiler.task
+    return files, second
+
+def test_profiling_session(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    files, second = asyncio.run(profile_session(profiler, 0.1))
+    assert second is None
+    assert files["duration"] == 0.1
+    assert session_files(tmp_path) == ["profile.prof", "profile.txt", "tasks.txt", "tracemalloc.txt"]
+    # no overhead once the session is over.
+    assert not tracemalloc.is_tracing()
+    assert not profiler.active
+
+def test_dump_task_stacks(tmp_path):
+    async def dump():
+        with open(tmp_path / "tasks.txt", 'w') as fp:
+            dump_task_stacks(fp)
+    asyncio.run(dump())
+    text = (tmp_path / "tasks.txt").read_text()
+    assert text.startswith("1 asyncio tasks")
+    assert "dump" in text
+
+def test_profiling_cancelled_session_writes_files(tmp_path):
+    async def cancelled():
+        profiler = Profiler(str(tmp_path))
+        profiler.start(60)
+        await asyncio.sleep(0.1)
+        await profiler.stop()
+    asyncio.run(cancelled())
+    assert len(session_files(tmp_path)) == 4
+
+def test_profiling_permissions(tmp_path):
+    server = IPCServer(message_processor=MessageProcessorReverse(), profile_directory=str(tmp_path))
+    uid = os.getuid()
+    other_uid = 12345 if uid == 0 else uid + 1
+    assert server.start_profiling(Peer(uid=other_uid)) == dict(return_code=RETURNCODES.NotPermitted)
+    server = IPCServer(message_processor=MessageProcessorReverse())
+    assert server.start_profiling(Peer(uid=uid)) == dict(return_code=RETURNCODES.Failed)
+
+def test_profile_command(tmp_path):
+    server = IPCServer(message_processor=MessageProcessorReverse(),
+                       socket_path=str(tmp_path), profile_directory=str(tmp_path))
+    server.open()
+    client = IPCClient(GPVpnAuthConfig(), socket_path=str(tmp_path))
+    client.open()
+    try:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(client.send_request(COMMANDS.Profile, duration=0.2),
+                                                                 delay=0.1),
+                                        run_awaitable_with_delay(server.stop(),
+                                                                 delay=0.6)
+                                        )
+                             )
+    finally:
+        client.close()
+    reply = result[1]
+    assert reply["return_code"] == RETURNCODES.Success
+    assert reply["duration"] == 0.2
+    assert os.path.exists(reply["profile_report"])
+    assert os.path.exists(reply["tracemalloc"])
+
+def test_profile_on_sigusr1(tmp_path):
+    server = IPCServer(message_processor=MessageProcessorReverse(),
+                       socket_path=str(tmp_path), handle_signals=True, profile_directory=str(tmp_path))
+    server.profiler.DURATION = 0.2
+    server.open()
+    async def send_signal():
+        os.kill(os.getpid(), signal.SIGUSR1)
+    asyncio.run(test_tasks(server.run(),
+                           run_awaitable_with_delay(send_signal(), delay=0.1),
+                           run_awaitable_with_delay(server.stop(), delay=0.6)))
+    assert len([p for p in tmp_path.iterdir() if p.name.startswith("gpvpn-")]) == 4
@@ -3,10 +3,16 @@ import asyncio
 import logging
 import os
 import grp
+import json
+import signal
+import contextlib
+
+import zmq
+import zmq.asyncio
 
 from conftest import *
 
-from gpvpn.server import IPCServer, IPCClient
+from gpvpn.server import IPCServer, IPCClient, Peer, FairQueue, RateLimiter, Request, peer_credentials, source_fd, unique_url
 from gpvpn.message_processors import MessageProcessorReverse
 from gpvpn.common import *
 from gpvpn.config import GPVpnAuthConfig
@@ -94,11 +100,11 @@ def test_ipcclient_in_group(ipcClient):
 
 def test_default_auth_settings_mockup():
     with IPCClientMockUp() as client:
-        auth_command = ["gpauthMockup/gpauthMockUp",
+        auth_command = ("gpauthMockup/gpauthMockUp",
                         "--fix-openssl",
                         "--default-browser",
                         "--gateway",
-                        "gpp.hereon.de"]
+                        "gpp.hereon.de")
         assert client.auth_command == auth_command
 
 def test_ipcclient_run_server():
@@ -125,7 +131,9 @@ def test_ipcclient_status():
                                                                  delay=2)
                                         )
                              )
-    assert result == [None, {'return_code': 2}, None]
+    assert result[0] == result[2] == None
+    assert result[1]['return_code'] == RETURNCODES.Inactive
+    assert result[1]['gateway'] == message_processor.cnf.vpnclient_url
 
     
 def test_ipcclient_auth():
@@ -162,3 +170,322 @@ def test_quit_server():
 
     
     
+class MessageProcessorSlow(MessageProcessorReverse):
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def process(self, json_message: str, peer: Peer | None = None) -> str:
+        await asyncio.sleep(self.delay)
+        return await super().process(json_message, peer)
+
+async def send_request_with_timeout(client, message, timeout):
+    try:
+        return await asyncio.wait_for(client.send_request(message), timeout)
+    except TimeoutError:
+        return None
+
+def test_shutdown_drains_request_in_flight():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=0.5))
+    server.open()
+    with IPCClientNoCheck() as client:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(client.send_request("hello"),
+                                                                 delay=0.1),
+                                        run_awaitable_with_delay(server.stop(),
+                                                                 delay=0.3)
+                                        )
+                             )
+    assert result == [None, {"return_code": "olleh"}, None]
+    assert server.shutdown_report["drained"]
+    assert not server.shutdown_report["abandoned"]
+    assert not os.path.exists(server._path)
+
+def test_shutdown_abandons_request_after_deadline():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=5))
+    server.DRAIN_TIMEOUT = 0.2
+    server.open()
+    with IPCClientNoCheck() as client:
+        client.socket.setsockopt(zmq.LINGER, 0)
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(send_request_with_timeout(client, "hello", 1),
+                                                                 delay=0.1),
+                                        run_awaitable_with_delay(server.stop(),
+                                                                 delay=0.3)
+                                        )
+                             )
+    assert result == [None, None, None]
+    assert server.shutdown_report["abandoned"]
+
+async def send_signal(signum):
+    os.kill(os.getpid(), signum)
+
+def test_shutdown_on_sigterm():
+    server = IPCServer(message_processor=MessageProcessorReverse(), handle_signals=True)
+    server.open()
+    result = asyncio.run(test_tasks(server.run(),
+                                    run_awaitable_with_delay(send_signal(signal.SIGTERM),
+                                                             delay=0.2)
+                                    )
+                         )
+    assert result == [None, None]
+    assert not server.shutdown_report["abandoned"]
+    assert not os.path.exists(server._path)
+
+class MessageProcessorReloadCounter(MessageProcessorReverse):
+    def __init__(self):
+        self.reloads = 0
+
+    def reload(self) -> None:
+        self.reloads += 1
+
+def test_reload_on_sighup():
+    message_processor = MessageProcessorReloadCounter()
+    server = IPCServer(message_processor=message_processor, handle_signals=True)
+    server.open()
+    asyncio.run(test_tasks(server.run(),
+                           run_awaitable_with_delay(send_signal(signal.SIGHUP), delay=0.1),
+                           run_awaitable_with_delay(server.stop(), delay=0.3)))
+    assert message_processor.reloads == 1
+
+class MessageProcessorRecorder(MessageProcessorSlow):
+    ''' Records the order in which commands are processed. '''
+    def __init__(self, delay):
+        super().__init__(delay)
+        self.processed = []
+
+    async def process(self, json_message: str, peer: Peer | None = None) -> str:
+        self.processed.append(deserialise(json_message)["command_code"])
+        await asyncio.sleep(self.delay)
+        return json.dumps(dict(return_code=RETURNCODES.Success))
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rate=0.001, burst=2)
+    assert rate_limiter.allow(1000)
+    assert rate_limiter.allow(1000)
+    assert not rate_limiter.allow(1000)
+    assert rate_limiter.allow(1001)
+
+def test_peer_credentials():
+    context = zmq.Context()
+    router = context.socket(zmq.ROUTER)
+    router.bind("ipc:///tmp/ipcserver_peer_test")
+    client = context.socket(zmq.REQ)
+    client.connect("ipc:///tmp/ipcserver_peer_test")
+    client.send(b"hello")
+    identity, _, frame = router.recv_multipart(copy=False)
+    peer = peer_credentials(source_fd(frame))
+    client.close()
+    router.close()
+    context.term()
+    assert peer == Peer(uid=os.getuid(), pid=os.getpid())
+
+def test_busy_when_queue_full():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=0.5))
+    server.queue = FairQueue(maxsize=1)
+    server.open()
+    with IPCClientNoCheck() as c0, IPCClientNoCheck() as c1, IPCClientNoCheck() as c2:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(c0.send_request("one"), delay=0.1),
+                                        run_awaitable_with_delay(c1.send_request("two"), delay=0.2),
+                                        run_awaitable_with_delay(c2.send_request("three"), delay=0.3),
+                                        run_awaitable_with_delay(server.stop(), delay=0.4)
+                                        )
+                             )
+    assert result[1:4] == [{"return_code": "eno"},
+                           {"return_code": "owt"},
+                           {"return_code": RETURNCODES.Busy}]
+    statistics = server.shutdown_report["statistics"]
+    assert statistics["rejected_queue_full"] == 1
+    assert statistics["max_queue_depth"] == 1
+    assert statistics["processed"] == 2
+
+def test_busy_when_rate_limited():
+    server = IPCServer(message_processor=MessageProcessorReverse())
+    server.rate_limiter = RateLimiter(rate=0.001, burst=1)
+    server.open()
+    with IPCClientNoCheck() as client:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(client.send_request("hello"), delay=0.1),
+                                        run_awaitable_with_delay(client.send_request("HELLO"), delay=0.2),
+                                        run_awaitable_with_delay(server.stop(), delay=0.3)
+                                        )
+                             )
+    assert result[1:3] == [{"return_code": "olleh"}, {"return_code": RETURNCODES.Busy}]
+    assert server.shutdown_report["statistics"]["rejected_rate_limit"] == 1
+
+def test_statistics_rate_limited():
+    server = IPCServer(message_processor=MessageProcessorReverse())
+    server.rate_limiter = RateLimiter(rate=0.001, burst=1)
+    server.open()
+    with IPCClientNoCheck() as client:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(client.send_request(COMMANDS.Statistics), delay=0.1),
+                                        run_awaitable_with_delay(client.send_request(COMMANDS.Statistics), delay=0.2),
+                                        run_awaitable_with_delay(server.stop(), delay=0.3)
+                                        )
+                             )
+    assert result[1]["return_code"] == RETURNCODES.Success
+    assert result[2] == {"return_code": RETURNCODES.Busy}
+
+def test_open_close_before_status():
+    message_processor = MessageProcessorRecorder(delay=0.3)
+    server = IPCServer(message_processor=message_processor)
+    server.open()
+    with IPCClientNoCheck() as c0, IPCClientNoCheck() as c1, IPCClientNoCheck() as c2:
+        asyncio.run(test_tasks(server.run(),
+                               run_awaitable_with_delay(c0.send_request(COMMANDS.Status), delay=0.1),
+                               run_awaitable_with_delay(c1.send_request(COMMANDS.Status), delay=0.15),
+                               run_awaitable_with_delay(c2.send_request(COMMANDS.Close), delay=0.2),
+                               run_awaitable_with_delay(server.stop(), delay=0.3)
+                               )
+                    )
+    assert message_processor.processed == [COMMANDS.Status, COMMANDS.Close, COMMANDS.Status]
+
+def queued_request(sequence, uid, command_code=COMMANDS.Status):
+    priority = 0 if command_code in IPCServer.PRIORITY_COMMANDS else 1
+    return Request(priority, sequence, b"", "", Peer(uid=uid), command_code, None, -1)
+
+def test_fair_queue_takes_turns():
+    queue = FairQueue()
+    # user 1000 polls in a loop; users 1001 and 1002 each send one request later.
+    for sequence in range(4):
+        queue.put_nowait(queued_request(sequence, 1000))
+    queue.put_nowait(queued_request(4, 1001))
+    queue.put_nowait(queued_request(5, 1002))
+    queue.put_nowait(queued_request(6, 1002, COMMANDS.Close))
+    assert queue.qsize() == 7
+    assert queue.user_qsize(1000) == 4
+    order = [(request.peer.uid, request.sequence) for request in (queue.get_nowait() for _ in range(7))]
+    assert order == [(1002, 6), (1000, 0), (1001, 4), (1002, 5), (1000, 1), (1000, 2), (1000, 3)]
+    assert queue.empty()
+    assert queue.user_qsize(1000) == 0
+
+def test_busy_when_user_queue_full():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=0.5))
+    server.USER_QUEUE_SIZE = 1
+    server.open()
+    with IPCClientNoCheck() as c0, IPCClientNoCheck() as c1, IPCClientNoCheck() as c2:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(c0.send_request("one"), delay=0.1),
+                                        run_awaitable_with_delay(c1.send_request("two"), delay=0.2),
+                                        run_awaitable_with_delay(c2.send_request("three"), delay=0.3),
+                                        run_awaitable_with_delay(server.stop(), delay=0.4)
+                                        )
+                             )
+    assert result[3] == {"return_code": RETURNCODES.Busy}
+    statistics = server.shutdown_report["statistics"]
+    assert statistics["rejected_user_queue_full"] == 1
+    assert statistics["users"][user_name(os.getuid())] == dict(received=3, processed=2, rejected=1, queued=0)
+
+def test_statistics():
+    server = IPCServer(message_processor=MessageProcessorReverse())
+    server.open()
+    with IPCClientNoCheck() as client:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(client.send_request("hello"), delay=0.1),
+                                        run_awaitable_with_delay(client.send_request(COMMANDS.Statistics), delay=0.2),
+                                        run_awaitable_with_delay(server.stop(), delay=0.3)
+                                        )
+                             )
+    statistics = result[2]
+    assert statistics["return_code"] == RETURNCODES.Success
+    assert statistics["received"] == 2
+    assert statistics["processed"] == 1
+    assert statistics["queue_depth"] == 0
+
+async def send_and_disconnect(message, delay):
+    ''' Sends a request and disconnects before the reply arrives, like a client interrupted by Ctrl-C. '''
+    client = IPCClientNoCheck()
+    client.open()
+    await client.socket.send_string(json.dumps(dict(command_code=message)))
+    await asyncio.sleep(delay)
+    client.socket.close(linger=0)
+    client.context.term()
+
+def test_deadline_passed_while_queued():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=0.5))
+    server.open()
+    with IPCClientNoCheck() as c0, IPCClientNoCheck() as c1:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(c0.send_request("one"), delay=0.1),
+                                        run_awaitable_with_delay(c1.send_request("two", timeout=0.2), delay=0.2),
+                                        run_awaitable_with_delay(server.stop(), delay=0.7)
+                                        )
+                             )
+    assert result[1:3] == [{"return_code": "eno"}, {"return_code": RETURNCODES.DeadlineExceeded}]
+    assert server.shutdown_report["statistics"]["deadline_exceeded"] == 1
+    assert server.shutdown_report["statistics"]["processed"] == 1
+
+def test_cancel_status_of_disconnected_client():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=0.5))
+    server.open()
+    asyncio.run(test_tasks(server.run(),
+                           run_awaitable_with_delay(send_and_disconnect(COMMANDS.Status, 0.1), delay=0.1),
+                           run_awaitable_with_delay(server.stop(), delay=0.4)
+                           )
+                )
+    statistics = server.shutdown_report["statistics"]
+    assert statistics["cancelled"] == 1
+    assert statistics["processed"] == 0
+    assert not server.shutdown_report["abandoned"]
+
+def test_drop_queued_status_of_disconnected_client():
+    server = IPCServer(message_processor=MessageProcessorSlow(delay=0.5))
+    server.open()
+    with IPCClientNoCheck() as client:
+        result = asyncio.run(test_tasks(server.run(),
+                                        run_awaitable_with_delay(client.send_request("one"), delay=0.1),
+                                        run_awaitable_with_delay(send_and_disconnect(COMMANDS.Status, 0.1), delay=0.2),
+                                        run_awaitable_with_delay(server.stop(), delay=0.7)
+                                        )
+                             )
+    assert result[1] == {"return_code": "eno"}
+    statistics = server.shutdown_report["statistics"]
+    assert statistics["cancelled"] == 1
+    assert statistics["processed"] == 1
+
+def test_authenticate_with_simulator(logincode):
+    client = IPCClientMockUp()
+    try:
+        assert asyncio.run(client.authenticate()).decode().strip() == logincode
+        client.auth_command += ("--fail",)
+        assert asyncio.run(client.authenticate()) == b""
+    finally:
+        client.close()
+
+# In-process transport
+def test_unique_url():
+    assert unique_url() != unique_url()
+    assert unique_url().startswith("inproc://gpvpn-")
+    assert unique_url("ipc").startswith("ipc:///")
+    with pytest.raises(ValueError):
+        unique_url("tcp")
+
+async def requests_in_process(servers, clients, messages):
+    async with contextlib.AsyncExitStack() as stack:
+        for server in servers:
+            await stack.enter_async_context(serving(server))
+        return [[await client.send_request(message) for message in messages] for client in clients]
+
+def test_inproc_servers_side_by_side():
+    context = zmq.asyncio.Context()
+    servers = [IPCServer(message_processor=MessageProcessorReverse(), url=unique_url(), context=context)
+               for _ in range(2)]
+    for server in servers:
+        server.open()
+    clients = [IPCClient(GPVpnAuthConfig(), url=server.url, context=context) for server in servers]
+    for client in clients:
+        client.open()
+    try:
+        replies = asyncio.run(requests_in_process(servers, clients, ["hello", "world"]))
+    finally:
+        for client in clients:
+            client.close()
+        context.term()
+    assert replies == [[{"return_code": "olleh"}, {"return_code": "dlrow"}]] * 2
+    for server in servers:
+        statistics = server.shutdown_report["statistics"]
+        assert statistics["processed"] == 2
+        # the client is this process.
+        assert statistics["users"][user_name(os.getuid())]["received"] == 2
+        assert not server.shutdown_report["socket_removed"]
@@ -0,0 +1,87 @@
+import pytest
+import asyncio
+import os
+import stat
+import time
+
+from gpvpn.status_page import StatusPageWriter, read_status_page
+from gpvpn.common import *
+
+# import some common functions, classes and fixtures:
+from conftest import *
+
+@pytest.fixture
+def writer(tmp_path):
+    w = StatusPageWriter(str(tmp_path / "gpvpn.status"))
+    w.open()
+    yield w
+    w.close()
+
+@pytest.fixture
+def message_processor(tmp_path):
+    mp = MessageProcessorVPNControllerWithTimeout(status_page=str(tmp_path / "gpvpn.status"))
+    mp.lockfile = str(tmp_path / "gpclient.lock")
+    return mp
+
+async def run_publisher(mp, duration=0.1):
+    ''' Runs the status page task for a while, and returns the page it published. '''
+    task = asyncio.create_task(mp.background_tasks()[0])
+    await asyncio.sleep(duration)
+    page = read_status_page(mp.status_page.path)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return page
+
+def test_missing_status_page(tmp_path):
+    assert read_status_page(str(tmp_path / "does_not_exist.status")) is None
+
+def test_unpublished_status_page(writer):
+    # the page exists, but the server did not publish anything yet.
+    assert read_status_page(writer.path) is None
+
+def test_status_page_permissions(writer):
+    mode = stat.S_IMODE(os.stat(writer.path).st_mode)
+    assert mode == stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP
+
+def test_publish_and_read(writer):
+    writer.publish(RETURNCODES.Active, 1234, 1000.0, "gpp.hereon.de")
+    page = read_status_page(writer.path)
+    assert page["return_code"] == RETURNCODES.Active
+    assert page["pid"] == 1234
+    assert page["since"] == 1000.0
+    assert page["gateway"] == "gpp.hereon.de"
+
+def test_stale_status_page(writer):
+    writer.publish(RETURNCODES.Active, 1234, 1000.0, "gpp.hereon.de")
+    time.sleep(0.05)
+    assert read_status_page(writer.path, max_age=0.01) is None
+
+def test_controller_publishes_status(message_processor):
+    mp = message_processor
+    page = asyncio.run(run_publisher(mp))
+    assert page["return_code"] == RETURNCODES.Inactive
+    assert page["pid"] == -1
+    assert page["gateway"] == mp.cnf.vpnclient_url
+    assert not os.path.exists(mp.status_page.path)
+
+def test_since_of_already_running_tunnel(message_processor):
+    # The tunnel was up before the server started: since should report
+    # when the lockfile was written, not when the server started.
+    mp = message_processor
+    with open(mp.lockfile, 'w') as fp:
+        fp.write(f"{os.getpid()}\n")
+    os.utime(mp.lockfile, (1000.0, 1000.0))
+    page = asyncio.run(run_publisher(mp))
+    assert page["return_code"] == RETURNCODES.Active
+    assert page["pid"] == os.getpid()
+    assert page["since"] == 1000.0
+
+def test_since_changes_with_state_only(message_processor):
+    mp = message_processor
+    mp.track_state(RETURNCODES.Inactive)
+    since = mp.since
+    time.sleep(0.01)
+    mp.track_state(RETURNCODES.Inactive)
+    assert mp.since == since
+    mp.track_state(RETURNCODES.Active)
+    assert mp.since > since
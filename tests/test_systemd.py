@@ -0,0 +1,96 @@
+import pytest
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import zmq
+
+from gpvpn import systemd
+
+# Stand-in for systemd: it moves the listening socket to fd 3, sets
+# LISTEN_PID/LISTEN_FDS and execs the server, so that the pid stays the
+# same, like systemd does after forking.
+LAUNCHER = """
+import os, sys
+fd = int(sys.argv[1])
+os.dup2(fd, 3)
+os.close(fd)
+os.environ["LISTEN_PID"] = str(os.getpid())
+os.environ["LISTEN_FDS"] = "1"
+os.execv(sys.executable, [sys.executable, "-c", sys.argv[2], *sys.argv[3:]])
+"""
+
+SERVER = """
+import asyncio, sys
+from gpvpn.server import IPCServer
+from gpvpn.message_processors import MessageProcessorReverse
+server = IPCServer(message_processor=MessageProcessorReverse(),
+                   socket_path=sys.argv[1], socket_name="ipcserver")
+server.open()
+asyncio.run(server.run())
+"""
+
+@pytest.fixture
+def notify_socket(tmp_path, monkeypatch):
+    path = str(tmp_path / "notify")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+        s.bind(path)
+        s.settimeout(10)
+        monkeypatch.setenv("NOTIFY_SOCKET", path)
+        yield s
+
+def test_listen_fds_not_activated(monkeypatch):
+    monkeypatch.delenv("LISTEN_PID", raising=False)
+    monkeypatch.delenv("LISTEN_FDS", raising=False)
+    assert systemd.listen_fds() == []
+
+def test_listen_fds_for_other_process(monkeypatch):
+    monkeypatch.setenv("LISTEN_PID", str(os.getpid() + 1))
+    monkeypatch.setenv("LISTEN_FDS", "1")
+    assert systemd.listen_fds() == []
+    assert "LISTEN_FDS" not in os.environ
+
+def test_watchdog_interval(monkeypatch):
+    monkeypatch.delenv("WATCHDOG_USEC", raising=False)
+    assert systemd.watchdog_interval() is None
+    monkeypatch.setenv("WATCHDOG_USEC", "30000000")
+    monkeypatch.setenv("WATCHDOG_PID", str(os.getpid()))
+    assert systemd.watchdog_interval() == 30
+    monkeypatch.setenv("WATCHDOG_PID", str(os.getpid() + 1))
+    assert systemd.watchdog_interval() is None
+
+def test_notify_without_service_manager(monkeypatch):
+    monkeypatch.delenv("NOTIFY_SOCKET", raising=False)
+    assert not systemd.notify("READY=1")
+
+def test_notify(notify_socket):
+    assert systemd.notify("READY=1")
+    assert notify_socket.recv(1024) == b"READY=1"
+
+def test_socket_activated_server(tmp_path, notify_socket):
+    path = str(tmp_path / "ipcserver")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    fd = listener.fileno()
+    process = subprocess.Popen([sys.executable, "-c", LAUNCHER, str(fd), SERVER, str(tmp_path)],
+                               pass_fds=(fd,))
+    listener.close() # the server owns the socket now
+    context = zmq.Context()
+    client = context.socket(zmq.REQ)
+    client.setsockopt(zmq.LINGER, 0)
+    client.setsockopt(zmq.RCVTIMEO, 5000)
+    try:
+        assert notify_socket.recv(1024) == b"READY=1"
+        client.connect(f"ipc://{path}")
+        client.send_string(json.dumps(dict(command_code="hello")))
+        assert json.loads(client.recv_string()) == dict(return_code="olleh")
+    finally:
+        client.close()
+        context.term()
+        process.terminate()
+        process.wait(timeout=5)
+    # the server should not have touched the socket file created by "systemd".
+    assert os.path.exists(path)